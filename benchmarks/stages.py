@@ -0,0 +1,267 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+STAGES = ['generate', 'transliterate', 'address', 'render', 'augment', 'augment_fields', 'encode', 'crop']
+END_TO_END = {
+    'end_to_end': [],
+    'end_to_end_stream': ['--stream'],
+}
+NUM_AUG = 3
+CARD_POOL = 16
+REFERENCE_DATE = '2025-01-01'
+
+
+def peak_rss_mb(maxrss):
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return maxrss / (1024 * 1024) if sys.platform == 'darwin' else maxrss / 1024
+
+
+def render_pool(pipeline, count):
+    cards = []
+    for i in range(min(count, CARD_POOL)):
+        image, boxes = pipeline.render_sample(i)
+        cards.append((image.copy(), boxes))
+    return cards
+
+
+def stage_workload(stage, pipeline, count, seed, codec='jpeg'):
+    # returns (run, samples): run() processes the workload once, samples is how many items that is
+    from src.IDCardPipeline import IDCardPipeline
+    from src.ImageCodec import ImageCodec
+    from src.IDCardDataGenerator import _romanize_name
+
+    generator = pipeline.generator
+
+    if stage == 'generate':
+        return lambda: [pipeline.sample_data(i) for i in range(count)], count
+
+    if stage == 'transliterate':
+        rng = random.Random(seed)
+        names = [rng.choice(generator.male_names + generator.female_names + generator.family_names)
+                 for _ in range(count)]
+
+        def run():
+            # names missing from the romanization table fall back to a cached pythainlp call
+            _romanize_name.cache_clear()
+            return [generator._transliterate_name(name) for name in names]
+        return run, count
+
+    if stage == 'address':
+        return lambda: [generator.generate_address(random.Random(seed + i)) for i in range(count)], count
+
+    if stage == 'render':
+        data = [pipeline.sample_data(i) for i in range(min(count, CARD_POOL))]
+        return lambda: [pipeline.renderer.render_data(data[i % len(data)]) for i in range(count)], count
+
+    cards = render_pool(pipeline, count)
+
+    if stage == 'augment':
+        augmentor = pipeline.augmentor
+        seeds = [augmentor.augment_seeds(seed, i) for i in range(count)]
+
+        def run():
+            return [augmentor.augment_boxes(*cards[i % len(cards)], seeds=seeds[i]) for i in range(count)]
+        return run, count * NUM_AUG
+
+    if stage == 'augment_fields':
+        augmentor = pipeline.augmentor
+        fields = pipeline.selected_fields
+
+        def run():
+            # one sample is every selected field augmented once, the field-mode share of one augmented card
+            for i in range(count):
+                image, boxes = cards[i % len(cards)]
+                augmentor.augment_fields(image, [
+                    (box['bbox'], augmentor.field_seeds(seed, i, box['class_id'], NUM_AUG))
+                    for box in boxes if box['class_name'] in fields
+                ])
+        return run, count * NUM_AUG
+
+    if stage == 'encode':
+        codec = ImageCodec.parse(codec)
+        return lambda: [codec.encode(cards[i % len(cards)][0]) for i in range(count)], count
+
+    if stage == 'crop':
+        fields = pipeline.selected_fields
+        return lambda: [list(IDCardPipeline.crop_fields(image, boxes, fields))
+                        for image, boxes in (cards[i % len(cards)] for i in range(count))], count
+
+    raise ValueError(f"Unknown stage: {stage}")
+
+
+def run_stage(stage, count, repeat, seed, codec='jpeg'):
+    os.chdir(ROOT)
+    from datetime import datetime
+    from src.IDCardPipeline import build_pipeline, select_fields
+
+    generator_options = {'current_date': datetime.strptime(REFERENCE_DATE, '%Y-%m-%d')}
+    pipeline = build_pipeline(NUM_AUG, select_fields('all'), generator_options, seed)
+
+    run, samples = stage_workload(stage, pipeline, count, seed, codec)
+    setup_rss = peak_rss_mb(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        seconds.append(time.perf_counter() - start)
+
+    return {
+        'samples': samples,
+        'seconds': min(seconds),
+        'samples_per_sec': samples / min(seconds),
+        'setup_rss_mb': setup_rss,
+        'peak_rss_mb': peak_rss_mb(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+    }
+
+
+def measure_stage(stage, count, repeat, seed, codec='jpeg'):
+    result = subprocess.run(
+        [sys.executable, __file__, '--stage', stage, '--count', str(count), '--repeat', str(repeat),
+         '--seed', str(seed), '--codec', codec],
+        cwd=ROOT, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        print(f"Warning: stage {stage} failed\n{result.stderr.strip()}")
+        return None
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def measure_end_to_end(extra_args, num_images, seed, workers):
+    output_dir = tempfile.mkdtemp(prefix='idcard_bench_')
+    try:
+        args = [sys.executable, 'generate_dataset.py', '--output', output_dir, '--num-images', str(num_images),
+                '--num-aug', str(NUM_AUG), '--seed', str(seed), '--reference-date', REFERENCE_DATE,
+                '--workers', str(workers), *extra_args]
+        start = time.perf_counter()
+        process = subprocess.Popen(args, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        # wait4 instead of wait so the child's resource usage comes back with its exit status
+        _, status, usage = os.wait4(process.pid, 0)
+        seconds = time.perf_counter() - start
+        exit_code = os.waitstatus_to_exitcode(status)
+        if exit_code != 0:
+            print(f"Warning: generate_dataset.py {' '.join(extra_args)} exited with {exit_code}")
+            return None
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    return {
+        'samples': num_images,
+        'seconds': seconds,
+        'samples_per_sec': num_images / seconds,
+        # largest single process; with --workers > 1 this is the biggest of the main process and workers
+        'peak_rss_mb': peak_rss_mb(usage.ru_maxrss)
+    }
+
+
+def git_commit():
+    result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True)
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+def print_results(results):
+    print("=" * 60)
+    print(f"Stage throughput (commit {results['meta']['commit']})")
+    for name, stats in results['stages'].items():
+        if stats is None:
+            print(f"  {name:<20} failed")
+            continue
+        print(f"  {name:<20} {stats['samples_per_sec']:10.1f} /s   peak RSS {stats['peak_rss_mb']:7.1f} MB")
+    print("=" * 60)
+
+
+def compare(old_path, new_path):
+    with open(old_path, 'r', encoding='utf-8') as f:
+        old = json.load(f)
+    with open(new_path, 'r', encoding='utf-8') as f:
+        new = json.load(f)
+
+    print("=" * 60)
+    print(f"{old['meta']['commit']} -> {new['meta']['commit']}")
+    print(f"  {'stage':<20} {'old /s':>10} {'new /s':>10} {'change':>8} {'RSS MB':>16}")
+    names = list(old['stages']) + [name for name in new['stages'] if name not in old['stages']]
+    for name in names:
+        before = old['stages'].get(name)
+        after = new['stages'].get(name)
+        if before is None or after is None:
+            print(f"  {name:<20} missing in one run")
+            continue
+        change = after['samples_per_sec'] / before['samples_per_sec'] - 1
+        print(f"  {name:<20} {before['samples_per_sec']:10.1f} {after['samples_per_sec']:10.1f} {change:+8.1%} "
+              f"{before['peak_rss_mb']:7.1f} -> {after['peak_rss_mb']:<7.1f}")
+    print("=" * 60)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure per-stage throughput and peak memory of the dataset generator')
+    parser.add_argument('--count', type=int, default=200, help='Samples per stage measurement (default: 200)')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed passes per stage, best is kept (default: 3)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for every stage (default: 0)')
+    parser.add_argument('--num-images', type=int, default=100,
+                        help='Base cards for the end-to-end generate_dataset.py runs (default: 100)')
+    parser.add_argument('--workers', type=int, default=1, help='Workers for the end-to-end runs (default: 1)')
+    parser.add_argument('--codec', type=str, default='jpeg',
+                        help='Image codec for the encode stage, as in generate_dataset.py --codec (default: jpeg)')
+    parser.add_argument('--only', type=str, nargs='+', default=None, choices=STAGES + list(END_TO_END),
+                        help='Run only these stages')
+    parser.add_argument('--json', type=str, default=None, help='Write results to this JSON file')
+    parser.add_argument('--compare', type=str, nargs=2, metavar=('OLD', 'NEW'), default=None,
+                        help='Print the change between two result files instead of measuring')
+    parser.add_argument('--stage', type=str, default=None, choices=STAGES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    if args.stage:
+        # child mode: one stage per interpreter so peak RSS belongs to that stage alone
+        print(json.dumps(run_stage(args.stage, args.count, args.repeat, args.seed, args.codec)))
+        return
+
+    selected = args.only or STAGES + list(END_TO_END)
+    stages = {}
+    for name in selected:
+        if name in END_TO_END:
+            stages[name] = measure_end_to_end(END_TO_END[name], args.num_images, args.seed, args.workers)
+        else:
+            stages[name] = measure_stage(name, args.count, args.repeat, args.seed, args.codec)
+
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'count': args.count,
+            'repeat': args.repeat,
+            'seed': args.seed,
+            'num_images': args.num_images,
+            'workers': args.workers,
+            'codec': args.codec,
+            'num_aug': NUM_AUG
+        },
+        'stages': stages
+    }
+    print_results(results)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
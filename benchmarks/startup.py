@@ -0,0 +1,131 @@
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+IMPORT_TARGETS = [
+    'src.AddressIndex',
+    'src.IDCardDataGenerator',
+    'src.IDCardRenderer',
+    'src.IDCardAugmentor',
+    'src.IDCardPipeline',
+    'generate_dataset',
+    'pythainlp.transliterate',
+    'matplotlib.pyplot',
+]
+
+
+def time_import(module, repeat):
+    code = (
+        "import time; t = time.perf_counter(); "
+        f"import {module}; "
+        "print(time.perf_counter() - t)"
+    )
+    samples = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True)
+        if result.returncode != 0:
+            return None
+        samples.append(float(result.stdout.strip().splitlines()[-1]))
+    return min(samples)
+
+
+def time_command(args, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *args], cwd=ROOT, capture_output=True)
+        samples.append(time.perf_counter() - start)
+    return min(samples)
+
+
+def time_call(fn, repeat):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - start)
+    return min(samples), result
+
+
+def parse_json(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def constructor_costs(repeat):
+    os.chdir(ROOT)
+    from src.IDCardPipeline import build_pipeline, RENDER_CONFIG, TEMPLATE_PATH
+    from src.IDCardDataGenerator import IDCardDataGenerator
+    from src.IDCardRenderer import IDCardRenderer
+    from src.IDCardAugmentor import IDCardAugmentor
+    from src.AddressIndex import AddressIndex
+
+    names_paths = [
+        'datasets/thai-names-corpus/male_names_th.txt',
+        'datasets/thai-names-corpus/female_names_th.txt',
+        'datasets/thai-names-corpus/family_names_th.txt',
+    ]
+    address_path = 'datasets/thai-province/province_with_district_and_sub_district.json'
+    romanization_path = 'datasets/thai-names-corpus/romanized_names.tsv'
+
+    generator = IDCardDataGenerator(*names_paths, address_path, 'datasets/thai-province/thai_streets_all.json',
+                                    romanization_path)
+    costs = {}
+    costs['generator.names'], _ = time_call(lambda: [generator._load_names(p) for p in names_paths], repeat)
+    costs['generator.province_json'], _ = time_call(lambda: parse_json(address_path), repeat)
+    costs['generator.address_index_build'], _ = time_call(
+        lambda: AddressIndex.build(parse_json(address_path)), repeat)
+    costs['generator.address_index_mmap'], _ = time_call(lambda: AddressIndex.load(address_path), repeat)
+    costs['generator.romanization_table'], _ = time_call(
+        lambda: generator._load_romanization_table(romanization_path), repeat)
+    costs['generator.total'], _ = time_call(
+        lambda: IDCardDataGenerator(*names_paths, address_path, 'datasets/thai-province/thai_streets_all.json',
+                                    romanization_path), repeat)
+
+    costs['renderer.constructor'], renderer = time_call(
+        lambda: IDCardRenderer(RENDER_CONFIG), repeat)
+    costs['renderer.load_template'], _ = time_call(
+        lambda: IDCardRenderer(RENDER_CONFIG).load_image(TEMPLATE_PATH), repeat)
+
+    costs['augmentor.constructor'], _ = time_call(lambda: IDCardAugmentor(num_augmentations_per_image=3), repeat)
+    costs['pipeline.build'], _ = time_call(lambda: build_pipeline(3, []), repeat)
+    return costs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure import and constructor cost of the dataset generator')
+    parser.add_argument('--repeat', type=int, default=3, help='Repetitions per measurement, best is kept (default: 3)')
+    parser.add_argument('--json', type=str, default=None, help='Write results to this JSON file')
+    args = parser.parse_args()
+
+    imports = {module: time_import(module, args.repeat) for module in IMPORT_TARGETS}
+    commands = {'generate_dataset.py --help': time_command(['generate_dataset.py', '--help'], args.repeat)}
+    constructors = constructor_costs(args.repeat)
+
+    print("=" * 60)
+    print("Import cost (fresh interpreter)")
+    for name, seconds in imports.items():
+        print(f"  {name:<40} {'unavailable' if seconds is None else f'{seconds * 1000:8.1f} ms'}")
+    print("Command cost")
+    for name, seconds in commands.items():
+        print(f"  {name:<40} {seconds * 1000:8.1f} ms")
+    print("Constructor cost (modules already imported)")
+    for name, seconds in constructors.items():
+        print(f"  {name:<40} {seconds * 1000:8.1f} ms")
+    print("=" * 60)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'imports': imports, 'commands': commands, 'constructors': constructors}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
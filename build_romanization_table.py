@@ -0,0 +1,31 @@
+from src.IDCardDataGenerator import IDCardDataGenerator
+import argparse
+import sys
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Precompute English romanizations for the Thai names corpus')
+    parser.add_argument('--output', type=str, default='datasets/thai-names-corpus/romanized_names.tsv',
+                        help='Output table (default: datasets/thai-names-corpus/romanized_names.tsv)')
+    args = parser.parse_args()
+
+    try:
+        count = IDCardDataGenerator.build_romanization_table(
+            names_paths=[
+                'datasets/thai-names-corpus/male_names_th.txt',
+                'datasets/thai-names-corpus/female_names_th.txt',
+                'datasets/thai-names-corpus/family_names_th.txt'
+            ],
+            output_path=args.output
+        )
+    except Exception as e:
+        print(f"Error: thai2rom could not romanize the corpus ({type(e).__name__}: {e}); "
+              f"install torch so pythainlp can load the model")
+        sys.exit(1)
+
+    print(f"  Romanized {count} names")
+    print(f"  Table saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
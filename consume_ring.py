@@ -0,0 +1,78 @@
+import os
+import time
+import argparse
+from tqdm import tqdm
+from src.CropRing import CropRingReader
+from src.ImageCodec import ImageCodec
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Read field crops from a generate_dataset.py --ring producer')
+    parser.add_argument('--ring', type=str, required=True, help='Shared-memory ring name given to the producer')
+    parser.add_argument('--batch-size', type=int, default=64, help='Crops claimed per read (default: 64)')
+    parser.add_argument('--count', type=int, default=None,
+                        help='Stop after this many crops (default: until the producer stops)')
+    parser.add_argument('--wait', type=float, default=30,
+                        help='Seconds to wait for the ring to appear (default: 30)')
+    parser.add_argument('--save', type=str, default=None,
+                        help='Also write the crops and labels.txt to this directory, like final_dataset')
+    parser.add_argument('--codec', type=str, default='jpeg',
+                        help='Image codec for --save, e.g. png:compression=1 (default: jpeg)')
+    args = parser.parse_args()
+
+    try:
+        codec = ImageCodec.parse(args.codec)
+    except ValueError as e:
+        parser.error(f'--codec: {e}')
+
+    try:
+        reader = CropRingReader(args.ring, timeout=args.wait)
+    except TimeoutError as e:
+        print(f"Error: {e}")
+        return
+
+    labels = None
+    if args.save:
+        from generate_dataset import LabelsWriter
+        os.makedirs(f'{args.save}/images', exist_ok=True)
+        labels = LabelsWriter(args.save, codec=codec)
+
+    count = 0
+    pixels = 0
+    fields = {}
+    start = time.perf_counter()
+    try:
+        with tqdm(total=args.count, desc="Consuming crops", unit='crop') as progress:
+            while args.count is None or count < args.count:
+                limit = args.batch_size if args.count is None else min(args.batch_size, args.count - count)
+                batch = reader.read_batch(limit)
+                if not batch:
+                    break
+                for field_img, text, field_name in batch:
+                    pixels += field_img.nbytes
+                    fields[field_name] = fields.get(field_name, 0) + 1
+                    if labels is not None:
+                        labels.write_image(field_img, text)
+                count += len(batch)
+                progress.update(len(batch))
+    except KeyboardInterrupt:
+        print("\n  Stopped")
+    finally:
+        elapsed = time.perf_counter() - start
+        # the ring cannot be unmapped while crop views are alive
+        batch = field_img = None
+        reader.release()
+        stats = reader.stats()
+        reader.close()
+        if labels is not None:
+            labels.close()
+
+    print(f"  Consumed {count} field images in {elapsed:.1f}s "
+          f"({count / max(elapsed, 1e-9):.1f} crops/s, {pixels / max(elapsed, 1e-9) / 2 ** 20:.1f} MiB/s)")
+    print("  Fields: " + ", ".join(f"{field} {n}" for field, n in sorted(fields.items())))
+    print(f"  Ring: {stats['produced']} produced, {stats['consumed']} consumed, {stats['ready']} ready, "
+          f"consumers waited {stats['consumer_wait_s']:.1f}s for crops")
+
+
+if __name__ == "__main__":
+    main()
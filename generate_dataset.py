@@ -1,233 +1,750 @@
-from src.IDCardRenderer import IDCardRenderer
-from src.IDCardDataGenerator import IDCardDataGenerator
-from src.IDCardAugmentor import IDCardAugmentor
+from src.IDCardAugmentor import FIELD_MARGIN
+from src.IDCardPipeline import IDCardPipeline, build_pipeline, select_fields, TEMPLATE_PATH
+from src.DatasetManifest import DatasetManifest
+from src.CropShards import ShardWriter
+from src.CropStore import CropStoreWriter, CropNormalizer
+from src.AsyncWriter import AsyncWriter
+from src.CardLabels import CardLabelWriter, CardLabelReader
+from src.CropRing import CropRingWriter
+from src.ImageCodec import ImageCodec, read_image
+from src import profiling
 import os
 import json
+import random
+import signal
 import argparse
+import itertools
+import multiprocessing
+from collections import Counter, deque
+from functools import partial
+from datetime import datetime
 from pathlib import Path
 from tqdm import tqdm
 
+CHECKPOINT_CARDS = 64
+RING_SHARD_CARDS = 8
+CODEC_STAGES = ['base', 'augment', 'crop']
+
+_worker_pipeline = None
+_worker_writer = None
+_worker_codecs = None
+_worker_stop = None
+
 
 def main():
     parser = argparse.ArgumentParser(description='Generate Thai ID card OCR dataset')
     parser.add_argument('--output', type=str, default='outputs', help='Output directory (default: outputs)')
     parser.add_argument('--num-images', type=int, default=80, help='Number of base images (default: 80)')
     parser.add_argument('--num-aug', type=int, default=3, help='Augmentations per image (default: 3)')
+    parser.add_argument('--aug-mode', type=str, default='card', choices=['card', 'field'],
+                        help='Augment whole cards before cropping, or each field crop on its own (default: card)')
+    parser.add_argument('--field-aug', type=str, nargs='+', default=None, metavar='FIELD=N',
+                        help='With --aug-mode field, augmentations for these fields instead of --num-aug')
+    parser.add_argument('--field-margin', type=int, default=FIELD_MARGIN,
+                        help=f'With --aug-mode field, card pixels kept around each field (default: {FIELD_MARGIN})')
     parser.add_argument('--lang', type=str, default='all', choices=['th', 'en', 'all'],
                         help='Language fields to extract: th, en, or all (default: all)')
+    parser.add_argument('--stream', action='store_true',
+                        help='Generate, augment and crop each card in memory; only field crops are written')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Worker processes for generation and augmentation (default: 1)')
+    parser.add_argument('--io-threads', type=int, default=4,
+                        help='Background threads per process encoding and writing output; 0 writes inline (default: 4)')
+    parser.add_argument('--address-weighting', type=str, default='province', choices=['province', 'sub_district'],
+                        help='Address sampling: uniform per province or per sub-district (default: province)')
+    parser.add_argument('--province-weights', type=str, default=None,
+                        help='JSON file mapping Thai province names to sampling weights (e.g. population)')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='Run seed; card i and its augmentations depend only on (seed, i) (default: random)')
+    parser.add_argument('--reference-date', type=str, default=None,
+                        help='Date treated as today for birth/issue/expiry dates, YYYY-MM-DD (default: today)')
+    parser.add_argument('--format', type=str, default='files', choices=['files', 'shards', 'memmap'],
+                        help='Field crop output: one JPEG per crop, packed tar shards with an offset index, or '
+                             'height-normalized grayscale pixels in one memory-mappable file (default: files)')
+    parser.add_argument('--shard-size', type=int, default=10000,
+                        help='Crops per shard with --format shards (default: 10000)')
+    parser.add_argument('--crop-height', type=int, default=32,
+                        help='Height every crop is resized to with --format memmap (default: 32)')
+    parser.add_argument('--codec', type=str, nargs='+', default=None, metavar='STAGE=SPEC',
+                        help=f"Image codec per output stage ({', '.join(CODEC_STAGES)}), e.g. base=png:compression=1 "
+                             "crop=jpeg:quality=90,progressive; codecs: jpeg, png, webp, raw (default: jpeg)")
+    parser.add_argument('--profile', action='store_true',
+                        help='Print per-stage and per-step timings and counters at the end of the run')
+    parser.add_argument('--profile-dump', type=str, default=None,
+                        help='With --profile, also write cProfile stats per stage to <PREFIX>.<stage>.pstats')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue an interrupted run in --output, skipping work recorded in its manifest')
+    parser.add_argument('--append', action='store_true',
+                        help='Add --num-images more cards to the dataset in --output, continuing its numbering')
+    parser.add_argument('--ring', type=str, default=None, metavar='NAME',
+                        help='Publish field crops to the shared-memory ring NAME until stopped instead of writing --output')
+    parser.add_argument('--ring-slots', type=int, default=512,
+                        help='Slots in the --ring buffer (default: 512)')
+    parser.add_argument('--ring-slot-size', type=int, default=256 * 1024,
+                        help='Bytes per --ring slot for one crop, its text and field name (default: 262144)')
     args = parser.parse_args()
 
-    num_images = args.num_images
-    num_augmentations = args.num_aug
-    template_path = 'template/personal-card-template.jpg'
-
-    th_fields = ['FullNameTH', 'BirthdayTH', 'Religion', 'Address', 'DateOfIssueTH', 'DateOfExpiryTH']
-    en_fields = ['Identification_Number', 'NameEN', 'LastNameEN', 'BirthdayEN', 'DateOfIssueEN', 'DateOfExpiryEN']
-
-    if args.lang == 'th':
-        selected_fields = th_fields
-    elif args.lang == 'en':
-        selected_fields = en_fields
+    if args.resume and args.append:
+        parser.error('--resume and --append cannot be combined')
+    if args.ring and (args.resume or args.append):
+        parser.error('--ring cannot be combined with --resume or --append')
+    if args.field_aug and args.aug_mode != 'field':
+        parser.error('--field-aug requires --aug-mode field')
+    if args.format == 'memmap' and any(value.startswith('crop=') for value in args.codec or []):
+        parser.error('--codec crop does not apply to --format memmap, which stores raw grayscale pixels')
+    if args.crop_height < 1:
+        parser.error('--crop-height must be at least 1')
+
+    manifest = None
+    if args.resume or args.append:
+        manifest = DatasetManifest.load(args.output)
+        if manifest is None:
+            parser.error(f'No {DatasetManifest.FILENAME} found in {args.output}')
+        if args.append:
+            manifest.num_images += args.num_images
     else:
-        selected_fields = th_fields + en_fields
+        province_weights = None
+        if args.province_weights:
+            with open(args.province_weights, 'r', encoding='utf-8') as f:
+                province_weights = json.load(f)
+        settings = {
+            'lang': args.lang,
+            'num_aug': args.num_aug,
+            'stream': args.stream,
+            'seed': args.seed if args.seed is not None else random.SystemRandom().randrange(2 ** 32),
+            'reference_date': args.reference_date or datetime.now().strftime('%Y-%m-%d'),
+            'address_weighting': args.address_weighting,
+            'province_weights': province_weights,
+            'format': args.format,
+            'shard_size': args.shard_size,
+            'crop_height': args.crop_height,
+            'aug_mode': args.aug_mode,
+            'field_aug': parse_field_aug(parser, args.field_aug, select_fields(args.lang)),
+            'field_margin': max(0, args.field_margin),
+            'codecs': parse_codecs(parser, args.codec)
+        }
+        manifest = DatasetManifest.create(args.output, settings, args.num_images)
+    # a ring producer runs until stopped and keeps no output to resume
+    if not args.ring:
+        os.makedirs(args.output, exist_ok=True)
+        manifest.save()
+
+    settings = manifest.settings
+    num_images = manifest.num_images
+    num_augmentations = settings['num_aug']
+    seed = settings['seed']
+    workers = max(1, args.workers)
+    io_threads = max(0, args.io_threads)
+    profile = args.profile or args.profile_dump is not None
+    if profile:
+        profiling.enable(args.profile_dump)
+
+    generator_options = {
+        'address_weighting': settings['address_weighting'],
+        'province_weights': settings['province_weights'],
+        'current_date': datetime.strptime(settings['reference_date'], '%Y-%m-%d')
+    }
+
+    selected_fields = select_fields(settings['lang'])
+
+    field_augmentations = None
+    if settings.get('aug_mode', 'card') == 'field':
+        overrides = settings['field_aug']
+        field_augmentations = {field: overrides.get(field, num_augmentations) for field in selected_fields}
+    field_margin = settings.get('field_margin', FIELD_MARGIN)
+    codecs = {
+        stage: ImageCodec.parse(spec, label=f'{stage}.{spec}')
+        for stage, spec in {**dict.fromkeys(CODEC_STAGES, 'jpeg'), **settings.get('codecs', {})}.items()
+    }
+    if settings['format'] == 'memmap':
+        # workers hand the store grayscale pixels at the target height instead of encoded crops
+        codecs['crop'] = CropNormalizer(settings['crop_height'], label=f"crop.gray:height={settings['crop_height']}")
 
     base_dir = f'{args.output}/base'
     augmented_dir = f'{args.output}/augmented_cards'
     final_dir = f'{args.output}/final_dataset'
 
-    os.makedirs(f'{base_dir}/labels', exist_ok=True)
-    os.makedirs(f'{augmented_dir}/images', exist_ok=True)
-    os.makedirs(f'{augmented_dir}/labels_bbox', exist_ok=True)
-    os.makedirs(f'{final_dir}/images', exist_ok=True)
-
-    render_config = 'configs/identity_card/config-for-feature-extraction.json'
-    label_config = 'configs/identity_card/config.json'
-    template_path = 'template/personal-card-template.jpg'
-
-    generator = IDCardDataGenerator(
-        male_names_path='datasets/thai-names-corpus/male_names_th.txt',
-        female_names_path='datasets/thai-names-corpus/female_names_th.txt',
-        family_names_path='datasets/thai-names-corpus/family_names_th.txt',
-        address_data_path='datasets/thai-province/province_with_district_and_sub_district.json',
-        streets_data_path='datasets/thai-province/thai_streets_all.json'
-    )
-
-    renderer = IDCardRenderer(
-        config_path=render_config,
-        font_paths={
-            'thai': ['fonts/dilleniaupc/DilleniaUPC Bold.ttf'],
-            'english': ['fonts/dilleniaupc/DilleniaUPC Bold.ttf']
-        }
-    )
-
-    if not renderer.load_image(template_path):
-        print(f"Error: Cannot load template from {template_path}")
-        return
-
-    augmentor = IDCardAugmentor(
-        num_augmentations_per_image=num_augmentations
-    )
-
-    with open(label_config, 'r', encoding='utf-8') as f:
-        config = json.load(f)
-    field_definitions = config['roi_extract']['front']
+    if not settings['stream'] and not args.ring:
+        os.makedirs(base_dir, exist_ok=True)
+        if field_augmentations is None:
+            os.makedirs(f'{augmented_dir}/images', exist_ok=True)
+    if settings['format'] == 'files' and not args.ring:
+        os.makedirs(f'{final_dir}/images', exist_ok=True)
+
+    pool = None
+    pool_stop = multiprocessing.Event()
+    if workers > 1:
+        pool = multiprocessing.Pool(
+            workers,
+            initializer=_init_pool_worker,
+            initargs=(pool_stop, num_augmentations, selected_fields, generator_options, seed, io_threads,
+                      profile, args.profile_dump, field_augmentations, field_margin, codecs)
+        )
+    else:
+        try:
+            _init_worker(num_augmentations, selected_fields, generator_options, seed, io_threads,
+                         profile, args.profile_dump, field_augmentations, field_margin, codecs)
+        except RuntimeError:
+            return
+
+    ring = None
+    if args.ring:
+        try:
+            ring = CropRingWriter(args.ring, max(1, args.ring_slots), args.ring_slot_size)
+        except FileExistsError:
+            print(f"Error: Shared memory {args.ring} already exists; stop its producer or pick another --ring name")
+            if pool is not None:
+                _stop_pool(pool, pool_stop)
+            return
 
     total_cards = num_images * (1 + num_augmentations) if num_augmentations > 0 else num_images
+    final_stage = 'stream' if settings['stream'] else 'crop'
+    if field_augmentations is None:
+        expected_images = total_cards * len(selected_fields)
+    else:
+        expected_images = num_images * (len(selected_fields) + sum(field_augmentations.values()))
 
     print("=" * 60)
     print("Setup completed")
-    print(f"  Base images: {num_images}")
-    print(f"  Augmentations per card: {num_augmentations}")
-    print(f"  Total cards: {total_cards} (base + augmented)")
-    print(f"  Selected fields: {len(selected_fields)} ({args.lang})")
-    print(f"  Expected final images: {total_cards * len(selected_fields)}")
+    if ring is not None:
+        print(f"  Ring: {args.ring} ({ring.slots} slots of {ring.slot_size} bytes)")
+    else:
+        print(f"  Base images: {num_images}")
+    if field_augmentations is None:
+        print(f"  Augmentations per card: {num_augmentations}")
+        if ring is None:
+            print(f"  Total cards: {total_cards} (base + augmented)")
+    else:
+        print("  Augmentations per field crop: " +
+              ", ".join(f"{field} {count}" for field, count in field_augmentations.items()))
+        print(f"  Field margin: {field_margin}px")
+    print(f"  Selected fields: {len(selected_fields)} ({settings['lang']})")
+    if ring is None:
+        print(f"  Expected final images: {expected_images}")
+    if ring is None:
+        if settings['stream']:
+            used_codecs = ['crop']
+        elif field_augmentations is not None or num_augmentations == 0:
+            used_codecs = ['base', 'crop']
+        else:
+            used_codecs = CODEC_STAGES
+        print("  Codecs: " + ", ".join(f"{stage} {codecs[stage].spec}" for stage in used_codecs))
+    print(f"  Workers: {workers}")
+    if ring is None:
+        print(f"  IO threads: {io_threads}")
+    print(f"  Seed: {seed}")
+    if ring is None:
+        print(f"  Completed cards: {manifest.completed_count(final_stage)} of {num_images}")
     print("=" * 60)
 
-    print("\nGenerating base images...")
-    generate_base_images(
-        num_images=num_images,
-        generator=generator,
-        renderer=renderer,
-        field_definitions=field_definitions,
-        output_dir=base_dir,
-        template_path=template_path
-    )
-
-    if num_augmentations > 0:
-        print("\nAugmenting full cards...")
-        augment_full_cards(
-            base_dir=base_dir,
-            augmentor=augmentor,
-            output_dir=augmented_dir
-        )
-        source_dirs = [base_dir, augmented_dir]
-        print(
-            f"  Using base + augmented: {num_images} + {num_images * num_augmentations} = {num_images * (1 + num_augmentations)} images")
+    # the main process reuses the serial worker's writer instead of starting a second pool
+    writer = _worker_writer if pool is None else AsyncWriter(io_threads)
+    if ring is not None:
+        sink = ring
+        # stop a producer run by a service manager as cleanly as one stopped with Ctrl+C
+        signal.signal(signal.SIGTERM, _raise_interrupt)
+    elif settings['format'] == 'shards':
+        sink = ShardWriter(f'{final_dir}/shards', settings['shard_size'], manifest.field_count, codecs['crop'])
+    elif settings['format'] == 'memmap':
+        sink = CropStoreWriter(f'{final_dir}/memmap', settings['crop_height'], manifest.field_count, codecs['crop'])
     else:
-        print("\nSkipping augmentation (num-aug=0)")
-        source_dirs = [base_dir]
-
-    print("\nCropping fields to final dataset...")
-    crop_fields_to_dataset(
-        source_dirs=source_dirs,
-        output_dir=final_dir,
-        selected_fields=selected_fields
-    )
-
-
-def generate_base_images(num_images, generator, renderer, field_definitions,
-                         output_dir, template_path):
-    for i in tqdm(range(num_images), desc="Generating base images"):
-        sample_data = generator.generate(
-            gender='random',
-            marital_status='random',
-            age_range=(18, 85)
-        )
-
-        if not renderer.load_image(template_path):
-            print(f"Error: Cannot reload template for image {i}")
-            continue
-
-        renderer.render_data(sample_data)
-
-        image_name = f'card_{i:04d}.jpg'
-        image_path = os.path.join(output_dir, image_name)
-        renderer.save(image_path)
-
-        boxes = []
-        for idx, field in enumerate(field_definitions):
-            field_name = field['name']
-            text = sample_data.get(field_name, "")
-
-            if field_name == 'Address':
-                text = f"ที่อยู่ {text}"
-
-            boxes.append({
-                'class_id': idx,
-                'class_name': field_name,
-                'bbox': field['point'],
-                'text': text
-            })
-
-        label_data = {'boxes': boxes}
-        label_path = os.path.join(output_dir, 'labels', f'card_{i:04d}.json')
-        with open(label_path, 'w', encoding='utf-8') as f:
-            json.dump(label_data, f, ensure_ascii=False, indent=2)
-
-    print(f"  Generated {num_images} base images")
-
-
-def augment_full_cards(base_dir, augmentor, output_dir):
-    base_image_files = list(Path(base_dir).glob('*.jpg'))
-    base_image_files.sort()
-
-    augmentor.process_files(
-        base_image_files,
-        output_dir
-    )
-
-    augmented_images = list(Path(f'{output_dir}/images').glob('*.jpg'))
-    print(f"  Generated {len(augmented_images)} augmented images")
-
-
-def crop_fields_to_dataset(source_dirs, output_dir, selected_fields):
-    import cv2
-
-    all_images = []
-    for source_dir in source_dirs:
-        images_dir = f'{source_dir}/images' if source_dir.endswith('augmented_cards') else source_dir
-        labels_dir = f'{source_dir}/labels_bbox' if source_dir.endswith('augmented_cards') else f'{source_dir}/labels'
-
-        for img_path in sorted(Path(images_dir).glob('*.jpg')):
-            label_path = Path(labels_dir) / f'{img_path.stem}.json'
-            if label_path.exists():
-                all_images.append((img_path, label_path))
-
-    field_counter = 0
-    labels_data = []
-
-    for img_path, label_path in tqdm(all_images, desc="Cropping fields"):
-        image = cv2.imread(str(img_path))
-        if image is None:
-            continue
-
-        with open(label_path, 'r', encoding='utf-8') as f:
-            label_data = json.load(f)
-
-        for box in label_data['boxes']:
-            class_name = box.get('class_name', '')
-
-            if class_name not in selected_fields:
-                continue
-
-            bbox = box['bbox']
-            text = box.get('text', '')
-
-            x1, y1, x2, y2 = map(int, bbox)
-
-            x1 = max(0, x1)
-            y1 = max(0, y1)
-            x2 = min(image.shape[1], x2)
-            y2 = min(image.shape[0], y2)
-
-            if x2 <= x1 or y2 <= y1:
+        sink = LabelsWriter(final_dir, manifest.field_count, manifest.labels_size, writer, codecs['crop'])
+    interrupted = False
+    try:
+        if ring is not None:
+            print(f"\nPublishing crops to ring {args.ring} until stopped (Ctrl+C)...")
+            with profiling.stage('ring'):
+                publish_ring(
+                    ring=ring,
+                    pool=pool,
+                    workers=workers
+                )
+            return
+
+        if settings['stream']:
+            print("\nStreaming cards to final dataset...")
+            with profiling.stage('stream'):
+                stream_dataset(
+                    manifest=manifest,
+                    pool=pool,
+                    workers=workers,
+                    sink=sink
+                )
+            return
+
+        print("\nGenerating base images...")
+        with profiling.stage('base'):
+            generate_base_images(
+                manifest=manifest,
+                pool=pool,
+                workers=workers,
+                output_dir=base_dir
+            )
+
+        if field_augmentations is not None:
+            print("\nCropping and augmenting fields to final dataset...")
+            with profiling.stage('crop'):
+                augment_field_crops(
+                    manifest=manifest,
+                    pool=pool,
+                    workers=workers,
+                    base_dir=base_dir,
+                    sink=sink
+                )
+            return
+
+        if num_augmentations > 0:
+            print("\nAugmenting full cards...")
+            with profiling.stage('augment'):
+                augment_full_cards(
+                    manifest=manifest,
+                    pool=pool,
+                    workers=workers,
+                    base_dir=base_dir,
+                    output_dir=augmented_dir
+                )
+            print(
+                f"  Using base + augmented: {num_images} + {num_images * num_augmentations} = {num_images * (1 + num_augmentations)} images")
+        else:
+            print("\nSkipping augmentation (num-aug=0)")
+
+        print("\nCropping fields to final dataset...")
+        with profiling.stage('crop'):
+            crop_fields_to_dataset(
+                manifest=manifest,
+                base_dir=base_dir,
+                augmented_dir=augmented_dir,
+                selected_fields=selected_fields,
+                num_augmentations=num_augmentations,
+                sink=sink
+            )
+    except BaseException:
+        interrupted = True
+        raise
+    finally:
+        with profiling.timer('io.close'):
+            sink.close()
+            writer.close()
+        if pool is not None:
+            # ring tasks never run out, and after an error or Ctrl+C the queued shards
+            # are skipped rather than waited for; --resume picks them up
+            if ring is not None or interrupted:
+                _stop_pool(pool, pool_stop)
+            else:
+                pool.close()
+                pool.join()
+        if profile:
+            profiling.print_report()
+
+
+def parse_field_aug(parser, values, selected_fields):
+    counts = {}
+    for value in values or []:
+        field, _, count = value.partition('=')
+        if not count.isdigit():
+            parser.error(f'--field-aug expects FIELD=N, got {value}')
+        if field not in selected_fields:
+            parser.error(f"--field-aug field {field} is not one of: {', '.join(selected_fields)}")
+        counts[field] = int(count)
+    return counts
+
+
+def parse_codecs(parser, values):
+    codecs = dict.fromkeys(CODEC_STAGES, 'jpeg')
+    for value in values or []:
+        stage, _, spec = value.partition('=')
+        if stage not in CODEC_STAGES:
+            parser.error(f"--codec stage {stage} is not one of: {', '.join(CODEC_STAGES)}")
+        try:
+            codecs[stage] = ImageCodec.parse(spec).spec
+        except ValueError as e:
+            parser.error(f'--codec {value}: {e}')
+    return codecs
+
+
+def shard_ranges(ranges, workers):
+    total = sum(end - start for start, end in ranges)
+    shard_size = max(1, min(CHECKPOINT_CARDS, -(-total // (workers * 4))))
+    return [
+        (shard_start, min(shard_start + shard_size, end))
+        for start, end in ranges
+        for shard_start in range(start, end, shard_size)
+    ]
+
+
+def run_tasks(fn, tasks, pool, stage=None, window=None):
+    if pool is None:
+        return map(fn, tasks)
+    fn = partial(_pool_task, fn)
+    profiled = profiling.enabled()
+    if profiled:
+        fn = partial(_profiled_task, fn, profiling.stage_dump_path(stage))
+    # imap reads all tasks up front, so endless task streams keep only a window of shards in flight
+    results = pool.imap(fn, tasks) if window is None else _imap_window(pool, fn, tasks, window)
+    return _merge_task_profiles(results) if profiled else results
+
+
+def _imap_window(pool, fn, tasks, window):
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.apply_async(fn, (task,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def _pool_task(fn, task):
+    # once the run is stopping, shards still queued are skipped so the pool drains quickly
+    if _worker_stop.is_set():
+        return None
+    return fn(task)
+
+
+def _profiled_task(fn, dump_path, task):
+    if dump_path is None:
+        result = fn(task)
+    else:
+        result = profiling.profile_call(f'{dump_path}.{os.getpid()}', fn, task)
+    return result, profiling.take()
+
+
+def _merge_task_profiles(results):
+    for result, stats in results:
+        profiling.merge(stats)
+        yield result
+
+
+def _init_pool_worker(stop, *args):
+    global _worker_stop
+    # Ctrl+C and service managers signal the whole process group; only the main process stops the run
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    _worker_stop = stop
+    _init_worker(*args)
+
+
+def _stop_pool(pool, stop):
+    # workers ignore SIGTERM, so pool.terminate() cannot stop them; queued shards are skipped
+    # instead and the pool only waits for the shards already running
+    stop.set()
+    pool.close()
+    pool.join()
+
+
+def _init_worker(num_augmentations, selected_fields, generator_options, seed, io_threads=0,
+                 profile=False, profile_dump=None, field_augmentations=None, field_margin=FIELD_MARGIN, codecs=None):
+    global _worker_pipeline, _worker_writer, _worker_codecs
+    if profile:
+        profiling.enable(profile_dump)
+    with profiling.timer('setup.pipeline'):
+        _worker_pipeline = build_pipeline(num_augmentations, selected_fields, generator_options, seed,
+                                          field_augmentations, field_margin)
+    if _worker_pipeline is None:
+        raise RuntimeError(f"Cannot load template from {TEMPLATE_PATH}")
+    _worker_writer = AsyncWriter(io_threads)
+    _worker_codecs = codecs or dict.fromkeys(CODEC_STAGES, ImageCodec())
+
+
+class LabelsWriter:
+    def __init__(self, path, count=0, size=0, writer=None, codec=None):
+        self.path = path
+        self.writer = writer or AsyncWriter(0)
+        self.codec = codec or ImageCodec()
+        self.file = open(os.path.join(path, 'labels.txt'), 'a+b')
+        # drop lines written after the last checkpoint; their crops are overwritten
+        self.file.truncate(size)
+        self.count = count
+        self.size = size
+
+    def _next_image(self, text):
+        field_filename = f'field_{self.count:05d}{self.codec.ext}'
+        line = f'{field_filename} {text}'.encode('utf-8')
+        if self.size:
+            line = b'\n' + line
+        self.file.write(line)
+        self.size += len(line)
+        self.count += 1
+        return os.path.join(self.path, 'images', field_filename)
+
+    def write(self, data, text):
+        self.writer.write_bytes(self._next_image(text), data)
+
+    def write_image(self, image, text):
+        self.writer.write_image(self._next_image(text), image, self.codec)
+
+    def checkpoint(self, manifest):
+        # the writer syncs each crop before its write completes, so after the flush every crop
+        # named in labels.txt is on disk before the manifest counts it
+        self.writer.flush()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        manifest.set_labels_state(self.count, self.size)
+        manifest.save()
+
+    def close(self):
+        self.file.close()
+
+
+def write_base_image(i, pipeline, output_dir, template_path, writer=None, codec=None):
+    renderer = pipeline.renderer
+    if not renderer.load_image(template_path):
+        print(f"Error: Cannot reload template for image {i}")
+        return None
+
+    _, boxes = pipeline.render_sample(i)
+
+    codec = codec or ImageCodec()
+    image_name = f'card_{i:04d}{codec.ext}'
+    renderer.save(os.path.join(output_dir, image_name), writer, codec)
+    return {'image': image_name, 'boxes': boxes}
+
+
+def _generate_base_shard(task):
+    start, end, output_dir = task
+    records = []
+    for i in range(start, end):
+        record = write_base_image(i, _worker_pipeline, output_dir, TEMPLATE_PATH, _worker_writer,
+                                  _worker_codecs['base'])
+        records.append([record] if record is not None else [])
+    # the shard is only reported complete once its files are written
+    _worker_writer.flush()
+    return start, end, records
+
+
+def run_card_stage(stage, manifest, labels, fn, tasks, pool, desc):
+    stats = Counter()
+    with tqdm(total=manifest.num_images, initial=manifest.completed_count(stage), desc=desc) as progress:
+        for start, end, records, *shard_stats in run_tasks(fn, tasks, pool, stage):
+            stats.update(*shard_stats)
+            with profiling.timer('checkpoint'):
+                for card_records in records:
+                    labels.write(card_records)
+                labels.checkpoint()
+                manifest.mark_complete(stage, start, end)
+                manifest.save()
+            progress.update(end - start)
+    return stats
+
+
+def generate_base_images(manifest, pool, workers, output_dir):
+    pending = manifest.pending_ranges('base')
+    tasks = [(start, end, output_dir) for start, end in shard_ranges(pending, workers)]
+
+    labels = CardLabelWriter(output_dir, manifest.completed_count('base'))
+    try:
+        run_card_stage('base', manifest, labels, _generate_base_shard, tasks, pool, "Generating base images")
+    finally:
+        labels.close()
+
+    print(f"  Generated {manifest.num_images} base images")
+
+
+def _augment_shard(task):
+    start, end, base_dir, output_dir = task
+    augmentor = _worker_pipeline.augmentor
+    base_labels = CardLabelReader(base_dir)
+    images_dir = os.path.join(output_dir, 'images')
+
+    records = []
+    for i in range(start, end):
+        card_records = []
+        for record in base_labels.read(i):
+            image = read_image(os.path.join(base_dir, record['image']))
+            if image is None:
                 continue
+            card_records.extend(augmentor.save_augmentations(
+                image,
+                record['boxes'],
+                augmentor.augment_seeds(_worker_pipeline.seed, i),
+                Path(record['image']).stem,
+                images_dir,
+                _worker_writer,
+                _worker_codecs['augment']
+            ))
+        records.append(card_records)
+
+    base_labels.close()
+    _worker_writer.flush()
+    return start, end, records, augmentor.take_stats()
+
+
+def augment_full_cards(manifest, pool, workers, base_dir, output_dir):
+    pending = manifest.pending_ranges('augment')
+    tasks = [(start, end, base_dir, output_dir) for start, end in shard_ranges(pending, workers)]
+
+    labels = CardLabelWriter(output_dir, manifest.completed_count('augment'))
+    try:
+        stats = run_card_stage('augment', manifest, labels, _augment_shard, tasks, pool, "Augmenting")
+    finally:
+        labels.close()
+
+    print(f"  Generated {stats['accepted']} augmented images")
+    print_augment_stats(stats)
+
+
+def print_augment_stats(stats):
+    if not stats['requested']:
+        return
 
-            field_img = image[y1:y2, x1:x2]
+    print(f"  Augmentation attempts: {stats['attempts']} for {stats['requested']} requested, "
+          f"{stats['accepted']} accepted")
+    rejected = {key[len('rejected_'):]: count for key, count in stats.items() if key.startswith('rejected_')}
+    if rejected:
+        print("  Rejected: " + ", ".join(f"{reason} {count}" for reason, count in sorted(rejected.items())))
+    if stats['exceptions']:
+        print(f"  Exceptions: {stats['exceptions']}")
+    if stats['shortfall']:
+        print(f"  Shortfall: {stats['shortfall']} augmentations not produced after 3 attempts each")
 
-            field_filename = f'field_{field_counter:05d}.jpg'
-            field_path = os.path.join(output_dir, 'images', field_filename)
-            cv2.imwrite(field_path, field_img)
 
-            labels_data.append(f'{field_filename} {text}')
-            field_counter += 1
+def card_sources(i, card_labels):
+    for directory, labels in card_labels:
+        for record in labels.read(i):
+            yield os.path.join(directory, record['image']), record
 
-    labels_txt_path = os.path.join(output_dir, 'labels.txt')
-    with open(labels_txt_path, 'w', encoding='utf-8') as f:
-        f.write('\n'.join(labels_data))
 
-    print(f"  Cropped {field_counter} field images")
-    print(f"  Labels saved to: {labels_txt_path}")
+def crop_fields_to_dataset(manifest, base_dir, augmented_dir, selected_fields, num_augmentations, sink):
+    pending = manifest.pending_ranges('crop')
+    card_labels = [(base_dir, CardLabelReader(base_dir))]
+    if num_augmentations > 0:
+        card_labels.append((os.path.join(augmented_dir, 'images'), CardLabelReader(augmented_dir)))
+
+    with tqdm(total=manifest.num_images, initial=manifest.completed_count('crop'),
+              desc="Cropping fields") as progress:
+        for start, end in shard_ranges(pending, 1):
+            for i in range(start, end):
+                for img_path, record in card_sources(i, card_labels):
+                    with profiling.timer('crop.read'):
+                        image = read_image(img_path)
+                    if image is None:
+                        continue
+
+                    with profiling.timer('crop.fields'):
+                        crops = list(IDCardPipeline.crop_fields(image, record['boxes'], selected_fields))
+                    with profiling.timer('crop.sink'):
+                        for field_img, text, _ in crops:
+                            sink.write_image(field_img, text)
+
+            manifest.mark_complete('crop', start, end)
+            with profiling.timer('checkpoint'):
+                sink.checkpoint(manifest)
+            progress.update(end - start)
+
+    for _, labels in card_labels:
+        labels.close()
+
+    print(f"  Cropped {sink.count} field images")
+    print(f"  Saved to: {sink.path}")
+
+
+def _augment_stats(pipeline):
+    return pipeline.augmentor.take_stats() if pipeline.augmentor is not None else Counter()
+
+
+def run_crop_stage(stage, manifest, fn, tasks, pool, sink, desc):
+    stats = Counter()
+    with tqdm(total=manifest.num_images, initial=manifest.completed_count(stage), desc=desc) as progress:
+        for start, end, entries, shard_stats in run_tasks(fn, tasks, pool, stage):
+            stats.update(shard_stats)
+            with profiling.timer(f'{stage}.sink'):
+                for data, text in entries:
+                    sink.write(data, text)
+
+            manifest.mark_complete(stage, start, end)
+            with profiling.timer('checkpoint'):
+                sink.checkpoint(manifest)
+            progress.update(end - start)
+
+    print(f"  Cropped {sink.count} field images")
+    print(f"  Saved to: {sink.path}")
+    print_augment_stats(stats)
+
+
+def _field_crop_shard(task):
+    start, end, base_dir = task
+    base_labels = CardLabelReader(base_dir)
+
+    entries = []
+    for i in range(start, end):
+        for img_path, record in card_sources(i, [(base_dir, base_labels)]):
+            with profiling.timer('crop.read'):
+                image = read_image(img_path)
+            if image is None:
+                continue
+            entries.extend(
+                (_worker_codecs['crop'].encode(field_img), text)
+                for field_img, text, _ in _worker_pipeline.iter_field_crops(i, image, record['boxes'])
+            )
+
+    base_labels.close()
+    return start, end, entries, _augment_stats(_worker_pipeline)
+
+
+def augment_field_crops(manifest, pool, workers, base_dir, sink):
+    tasks = [(start, end, base_dir) for start, end in shard_ranges(manifest.pending_ranges('crop'), workers)]
+    run_crop_stage('crop', manifest, _field_crop_shard, tasks, pool, sink, "Cropping and augmenting fields")
+
+
+def _stream_shard(task):
+    start, end = task
+    entries = [
+        (_worker_codecs['crop'].encode(field_img), text)
+        for i in range(start, end)
+        for field_img, text, _ in _worker_pipeline.iter_sample_crops(i)
+    ]
+    return start, end, entries, _augment_stats(_worker_pipeline)
+
+
+def stream_dataset(manifest, pool, workers, sink):
+    tasks = shard_ranges(manifest.pending_ranges('stream'), workers)
+    run_crop_stage('stream', manifest, _stream_shard, tasks, pool, sink, "Streaming cards")
+
+
+def _raise_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def _ring_shard(task):
+    start, end = task
+    # crops are views of buffers the next card reuses
+    entries = [
+        (field_img.copy(), text, field_name)
+        for i in range(start, end)
+        for field_img, text, field_name in _worker_pipeline.iter_sample_crops(i)
+    ]
+    return start, end, entries, _augment_stats(_worker_pipeline)
+
+
+def publish_ring(ring, pool, workers):
+    tasks = ((start, start + RING_SHARD_CARDS) for start in itertools.count(0, RING_SHARD_CARDS))
+    stats = Counter()
+    try:
+        with tqdm(desc="Publishing crops", unit='crop') as progress:
+            for start, end, entries, shard_stats in run_tasks(_ring_shard, tasks, pool, 'ring', window=workers * 2):
+                stats.update(shard_stats)
+                with profiling.timer('ring.publish'):
+                    for field_img, text, field_name in entries:
+                        ring.write(field_img, text, field_name)
+                progress.update(len(entries))
+                ring_stats = ring.stats()
+                progress.set_postfix(
+                    ready=ring_stats['ready'],
+                    consumed=ring_stats['consumed'],
+                    waited=f"{ring_stats['producer_wait_s']:.1f}s",
+                    refresh=False
+                )
+    except KeyboardInterrupt:
+        print("\n  Stopped")
+
+    ring_stats = ring.stats()
+    print(f"  Published {ring_stats['produced']} field images, {ring_stats['consumed']} consumed")
+    print(f"  Waiting for consumers: {ring_stats['producer_wait_s']:.1f}s")
+    if ring_stats['dropped']:
+        print(f"  Warning: {ring_stats['dropped']} crops larger than --ring-slot-size were dropped")
+    if ring_stats['abandoned']:
+        print(f"  Warning: {ring_stats['abandoned']} slots claimed by exited consumers were reclaimed")
+    print_augment_stats(stats)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,270 @@
+import os
+import json
+import random
+import hashlib
+import numpy as np
+
+BANGKOK = "กรุงเทพมหานคร"
+
+_MAGIC = b'THADDRIX'
+_VERSION = 1
+_ALIGN = 64
+
+
+def _align(n):
+    return -(-n // _ALIGN) * _ALIGN
+
+
+def _pack_strings(strings):
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def _write_arrays(path, meta, arrays):
+    specs = {}
+    offset = 0
+    for name, arr in arrays.items():
+        specs[name] = {'dtype': arr.dtype.str, 'shape': list(arr.shape), 'offset': offset}
+        offset += _align(arr.nbytes)
+
+    header = json.dumps({'version': _VERSION, 'meta': meta, 'arrays': specs}).encode('utf-8')
+    data_start = _align(len(_MAGIC) + 8 + len(header))
+
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_MAGIC)
+        f.write(len(header).to_bytes(8, 'little'))
+        f.write(header)
+        for name, arr in arrays.items():
+            f.seek(data_start + specs[name]['offset'])
+            f.write(np.ascontiguousarray(arr).tobytes())
+    os.replace(tmp_path, path)
+
+
+def _read_arrays(path):
+    with open(path, 'rb') as f:
+        if f.read(len(_MAGIC)) != _MAGIC:
+            raise ValueError(f"{path} is not an address index")
+        header_len = int.from_bytes(f.read(8), 'little')
+        header = json.loads(f.read(header_len).decode('utf-8'))
+
+    if header.get('version') != _VERSION:
+        raise ValueError(f"{path} has unsupported version {header.get('version')}")
+
+    data_start = _align(len(_MAGIC) + 8 + header_len)
+    buffer = np.memmap(path, dtype=np.uint8, mode='r').view(np.ndarray)
+
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        dtype = np.dtype(spec['dtype'])
+        shape = tuple(spec['shape'])
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        start = data_start + spec['offset']
+        arrays[name] = buffer[start:start + nbytes].view(dtype).reshape(shape)
+    return header['meta'], arrays
+
+
+def _build_alias(weights):
+    weights = np.asarray(weights, dtype=np.float64)
+    total = weights.sum()
+    if not total > 0:
+        raise ValueError("Address weights must have a positive sum")
+
+    n = len(weights)
+    prob = weights * n / total
+    alias = np.arange(n, dtype=np.int32)
+
+    small = [i for i in range(n) if prob[i] < 1.0]
+    large = [i for i in range(n) if prob[i] >= 1.0]
+    while small and large:
+        s = small.pop()
+        l = large.pop()
+        alias[s] = l
+        prob[l] = prob[l] + prob[s] - 1.0
+        (small if prob[l] < 1.0 else large).append(l)
+
+    for i in small + large:
+        prob[i] = 1.0
+    return prob, alias
+
+
+class AddressIndex:
+    WEIGHTINGS = ('province', 'sub_district')
+
+    def __init__(self, meta, arrays):
+        self.meta = meta
+        self.leaf_province = arrays['leaf_province']
+        self.leaf_district = arrays['leaf_district']
+        self.leaf_sub_district = arrays['leaf_sub_district']
+        self.alias_prob = arrays['alias_prob']
+        self.alias_index = arrays['alias_index']
+        self._strings = {
+            kind: (arrays[f'{kind}_bytes'], arrays[f'{kind}_offsets'])
+            for kind in ('province', 'district', 'sub_district', 'fragment')
+        }
+
+    def __len__(self):
+        return len(self.alias_prob)
+
+    @classmethod
+    def load(cls, address_data_path, cache_path=None, weighting='province', province_weights=None):
+        if cache_path is None:
+            cache_path = os.path.splitext(address_data_path)[0] + '.idx'
+
+        try:
+            stat = os.stat(address_data_path)
+        except OSError as e:
+            print(f"Warning: Could not load address data: {e}")
+            return None
+
+        fingerprint = cls._fingerprint(stat, weighting, province_weights)
+
+        if os.path.exists(cache_path):
+            try:
+                meta, arrays = _read_arrays(cache_path)
+                if meta.get('fingerprint') == fingerprint:
+                    return cls(meta, arrays)
+            except Exception as e:
+                print(f"Warning: Ignoring address index cache {cache_path}: {e}")
+
+        try:
+            with open(address_data_path, 'r', encoding='utf-8') as f:
+                address_data = json.load(f)
+        except Exception as e:
+            print(f"Warning: Could not load address data: {e}")
+            return None
+
+        meta, arrays = cls.build(address_data, weighting, province_weights)
+        meta['fingerprint'] = fingerprint
+
+        try:
+            _write_arrays(cache_path, meta, arrays)
+        except OSError as e:
+            print(f"Warning: Could not write address index cache {cache_path}: {e}")
+        return cls(meta, arrays)
+
+    @staticmethod
+    def _fingerprint(stat, weighting, province_weights):
+        weights_key = json.dumps(province_weights, sort_keys=True, ensure_ascii=False) if province_weights else ''
+        digest = hashlib.sha1(weights_key.encode('utf-8')).hexdigest()
+        return f"{stat.st_size}:{stat.st_mtime_ns}:{weighting}:{digest}"
+
+    @staticmethod
+    def build(address_data, weighting='province', province_weights=None):
+        if weighting not in AddressIndex.WEIGHTINGS:
+            raise ValueError(f"Unknown address weighting: {weighting}")
+
+        province_names = []
+        district_names = []
+        sub_district_names = []
+        leaf_province = []
+        leaf_district = []
+        leaf_sub_district = []
+        fragments = []
+        weights = []
+
+        if province_weights is not None:
+            missing = [p['name_th'] for p in address_data if p['name_th'] not in province_weights]
+            if missing:
+                print(f"Warning: {len(missing)} provinces have no weight and will not be sampled")
+
+        for province in address_data:
+            p_idx = len(province_names)
+            province_name_th = province['name_th']
+            province_names.append(province_name_th)
+
+            if province_weights is not None:
+                province_weight = float(province_weights.get(province_name_th, 0.0))
+            else:
+                province_weight = 1.0
+
+            districts = province.get('districts') or [None]
+            for district in districts:
+                if district is None:
+                    d_idx = -1
+                    district_name_th = ""
+                    sub_districts = [None]
+                else:
+                    d_idx = len(district_names)
+                    district_name_th = district['name_th']
+                    district_names.append(district_name_th)
+                    sub_districts = district.get('sub_districts') or [None]
+
+                for sub_district in sub_districts:
+                    if sub_district is None:
+                        s_idx = -1
+                        sub_district_name_th = ""
+                    else:
+                        s_idx = len(sub_district_names)
+                        sub_district_name_th = sub_district['name_th']
+                        sub_district_names.append(sub_district_name_th)
+
+                    if province_name_th == BANGKOK:
+                        district_prefix = "" if district_name_th.startswith("เขต") else "เขต"
+                        fragment = f" แขวง{sub_district_name_th} {district_prefix}{district_name_th} {province_name_th}"
+                    else:
+                        tambon = f" ต.{sub_district_name_th}" if sub_district_name_th else ""
+                        amphoe = f" อ.{district_name_th}" if district_name_th else ""
+                        fragment = f"{tambon}{amphoe} จ.{province_name_th}"
+
+                    if weighting == 'sub_district':
+                        weight = province_weight
+                    else:
+                        weight = province_weight / (len(districts) * len(sub_districts))
+
+                    leaf_province.append(p_idx)
+                    leaf_district.append(d_idx)
+                    leaf_sub_district.append(s_idx)
+                    fragments.append(fragment)
+                    weights.append(weight)
+
+        alias_prob, alias_index = _build_alias(weights)
+
+        arrays = {
+            'leaf_province': np.asarray(leaf_province, dtype=np.int32),
+            'leaf_district': np.asarray(leaf_district, dtype=np.int32),
+            'leaf_sub_district': np.asarray(leaf_sub_district, dtype=np.int32),
+            'alias_prob': alias_prob,
+            'alias_index': alias_index,
+        }
+        for kind, strings in (('province', province_names), ('district', district_names),
+                              ('sub_district', sub_district_names), ('fragment', fragments)):
+            arrays[f'{kind}_bytes'], arrays[f'{kind}_offsets'] = _pack_strings(strings)
+
+        meta = {'weighting': weighting, 'num_leaves': len(fragments)}
+        return meta, arrays
+
+    def _string(self, kind, idx):
+        if idx < 0:
+            return ""
+        data, offsets = self._strings[kind]
+        return bytes(data[offsets[idx]:offsets[idx + 1]]).decode('utf-8')
+
+    def sample(self, rng=random):
+        u = rng.random() * len(self.alias_prob)
+        leaf = int(u)
+        if u - leaf >= self.alias_prob[leaf]:
+            leaf = int(self.alias_index[leaf])
+        return leaf
+
+    def sample_batch(self, n, rng):
+        u = rng.random(n) * len(self.alias_prob)
+        leaves = u.astype(np.int64)
+        rejected = (u - leaves) >= self.alias_prob[leaves]
+        leaves[rejected] = self.alias_index[leaves[rejected]]
+        return leaves
+
+    def parts_batch(self, leaves):
+        unique_leaves, inverse = np.unique(leaves, return_inverse=True)
+        columns = zip(*(self.parts(leaf) for leaf in unique_leaves.tolist())) if len(unique_leaves) else [()] * 4
+        return tuple(np.asarray(column, dtype=object)[inverse] for column in columns)
+
+    def parts(self, leaf):
+        return (
+            self._string('province', self.leaf_province[leaf]),
+            self._string('district', self.leaf_district[leaf]),
+            self._string('sub_district', self.leaf_sub_district[leaf]),
+            self._string('fragment', leaf)
+        )
@@ -0,0 +1,100 @@
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from .ImageCodec import ImageCodec
+from . import profiling
+
+
+def _write_bytes(path, data):
+    with profiling.timer('io.write'), open(path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _write_image(path, image, codec):
+    _write_bytes(path, codec.encode(image))
+
+
+def _write_json(path, data, indent):
+    with profiling.timer('io.write'), open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=indent)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class AsyncWriter:
+    def __init__(self, num_threads=4, max_pending=None):
+        self.num_threads = num_threads
+        self._executor = None
+        if num_threads > 0:
+            self._executor = ThreadPoolExecutor(num_threads, thread_name_prefix='writer')
+        # producers block here once this many writes are queued or running
+        self._slots = threading.BoundedSemaphore(max_pending or num_threads * 8 or 1)
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._error = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _done(self, future):
+        with self._lock:
+            # futures a flush already waited on have had their errors reported there
+            if future in self._pending:
+                self._pending.discard(future)
+                if future.exception() is not None and self._error is None:
+                    self._error = future.exception()
+        self._slots.release()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def submit(self, fn, *args):
+        if self._executor is None:
+            fn(*args)
+            return
+
+        self._raise_error()
+        with profiling.timer('io.backpressure'):
+            self._slots.acquire()
+        future = self._executor.submit(fn, *args)
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._done)
+
+    def write_bytes(self, path, data):
+        self.submit(_write_bytes, path, data)
+
+    def write_image(self, path, image, codec=None):
+        # the image must not be modified until the write is flushed
+        self.submit(_write_image, path, image, codec or ImageCodec.for_path(path))
+
+    def write_json(self, path, data, indent=2):
+        self.submit(_write_json, path, data, indent)
+
+    def flush(self):
+        with self._lock:
+            pending = list(self._pending)
+        wait(pending)
+        # wait() can return before _done has run, so failures are read from the futures themselves
+        with self._lock:
+            self._pending.difference_update(pending)
+            errors = [future.exception() for future in pending if future.exception() is not None]
+            if self._error is None and errors:
+                self._error = errors[0]
+        self._raise_error()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
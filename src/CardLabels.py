@@ -0,0 +1,65 @@
+import os
+import json
+import numpy as np
+
+LABELS_FILENAME = 'labels.jsonl'
+INDEX_FILENAME = 'labels.idx'
+OFFSET_DTYPE = np.dtype('<i8')
+
+
+class CardLabelWriter:
+    def __init__(self, path, count=0):
+        self.path = path
+        self.count = count
+        os.makedirs(path, exist_ok=True)
+        self.file = open(os.path.join(path, LABELS_FILENAME), 'a+b')
+        # entry i of the index is where card i's records start; the last entry is the end of the file
+        self.index = open(os.path.join(path, INDEX_FILENAME), 'a+b')
+
+        self.size = 0
+        if count:
+            self.index.seek(count * OFFSET_DTYPE.itemsize)
+            self.size = int(np.frombuffer(self.index.read(OFFSET_DTYPE.itemsize), dtype=OFFSET_DTYPE)[0])
+
+        # records written after the last checkpoint are dropped and rewritten
+        self.file.truncate(self.size)
+        self.index.truncate(count * OFFSET_DTYPE.itemsize)
+        self.index.write(np.array([self.size], dtype=OFFSET_DTYPE).tobytes())
+
+    def write(self, records):
+        for record in records:
+            line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+            self.file.write(line)
+            self.size += len(line)
+        self.index.write(np.array([self.size], dtype=OFFSET_DTYPE).tobytes())
+        self.count += 1
+
+    def checkpoint(self):
+        for f in (self.file, self.index):
+            f.flush()
+            os.fsync(f.fileno())
+
+    def close(self):
+        self.file.close()
+        self.index.close()
+
+
+class CardLabelReader:
+    def __init__(self, path):
+        self.path = path
+        self.offsets = np.memmap(os.path.join(path, INDEX_FILENAME), dtype=OFFSET_DTYPE, mode='r')
+        self.file = open(os.path.join(path, LABELS_FILENAME), 'rb')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def read(self, i):
+        if not 0 <= i < len(self):
+            raise IndexError(f"Card index {i} out of range for {len(self)} cards")
+
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        self.file.seek(start)
+        return [json.loads(line) for line in self.file.read(end - start).splitlines()]
+
+    def close(self):
+        self.file.close()
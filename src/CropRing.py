@@ -0,0 +1,261 @@
+import os
+import time
+import fcntl
+import tempfile
+import numpy as np
+from multiprocessing import shared_memory
+from . import profiling
+
+MAGIC = 0x474E4952504F5243
+VERSION = 1
+HEADER_DTYPE = np.dtype([(name, '<i8') for name in (
+    'magic', 'version', 'slots', 'slot_size', 'head', 'tail', 'produced', 'consumed', 'dropped', 'abandoned',
+    'closed', 'producer_wait_ns', 'consumer_wait_ns'
+)])
+HEADER_BYTES = 128
+SLOT_DTYPE = np.dtype([
+    ('state', '<i8'), ('owner', '<i4'), ('height', '<i4'), ('width', '<i4'), ('channels', '<i4'),
+    ('text_len', '<i4'), ('field_len', '<i4')
+])
+EMPTY, FULL, CLAIMED = 0, 1, 2
+POLL_SECONDS = 0.001
+OWNER_CHECK_SECONDS = 1.0
+
+
+def _lock_path(name):
+    return os.path.join(tempfile.gettempdir(), f'{name.lstrip("/")}.ring.lock')
+
+
+def _data_offset(slots):
+    return -(-(HEADER_BYTES + slots * SLOT_DTYPE.itemsize) // 64) * 64
+
+
+def _views(shm, slots):
+    header = np.ndarray((), dtype=HEADER_DTYPE, buffer=shm.buf)
+    table = np.ndarray((slots,), dtype=SLOT_DTYPE, buffer=shm.buf, offset=HEADER_BYTES)
+    return header, table
+
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # before Python 3.13 every attaching process registers the block and unlinks it on exit
+        from multiprocessing import resource_tracker
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class _FileLock:
+    # flock works between unrelated processes, so consumers need nothing from the producer but the ring name
+    def __init__(self, path):
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+
+    def __enter__(self):
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def close(self):
+        os.close(self.fd)
+
+
+def ring_stats(header):
+    head = int(header['head'])
+    return {
+        'produced': int(header['produced']),
+        'consumed': int(header['consumed']),
+        'ready': head - int(header['tail']),
+        'dropped': int(header['dropped']),
+        'abandoned': int(header['abandoned']),
+        'producer_wait_s': int(header['producer_wait_ns']) / 1e9,
+        'consumer_wait_s': int(header['consumer_wait_ns']) / 1e9
+    }
+
+
+class CropRingWriter:
+    def __init__(self, name, slots=512, slot_size=256 * 1024):
+        self.name = name
+        self.slots = slots
+        self.slot_size = slot_size
+        self.data_offset = _data_offset(slots)
+        self.shm = shared_memory.SharedMemory(name=name, create=True, size=self.data_offset + slots * slot_size)
+        self.lock = _FileLock(_lock_path(name))
+        self.header, self.table = _views(self.shm, slots)
+        self.head = 0
+
+        self.table[...] = 0
+        self.header[...] = 0
+        self.header['version'] = VERSION
+        self.header['slots'] = slots
+        self.header['slot_size'] = slot_size
+        # readers treat the ring as ready once the magic is set
+        self.header['magic'] = MAGIC
+
+    def _wait_for_slot(self, slot):
+        start = time.perf_counter_ns()
+        checked = time.monotonic()
+        with profiling.timer('ring.backpressure'):
+            while self.table['state'][slot] != EMPTY:
+                time.sleep(POLL_SECONDS)
+                if time.monotonic() - checked < OWNER_CHECK_SECONDS:
+                    continue
+                checked = time.monotonic()
+                # a consumer that died mid-batch never releases its slots
+                with self.lock:
+                    owner = int(self.table['owner'][slot])
+                    if self.table['state'][slot] == CLAIMED and not _alive(owner):
+                        self.table['state'][slot] = EMPTY
+                        self.header['abandoned'] += 1
+        self.header['producer_wait_ns'] += time.perf_counter_ns() - start
+
+    def write(self, image, text, field_name):
+        text = text.encode('utf-8')
+        field_name = field_name.encode('utf-8')
+        image = np.ascontiguousarray(image, dtype=np.uint8)
+        if image.nbytes + len(text) + len(field_name) > self.slot_size:
+            with self.lock:
+                self.header['dropped'] += 1
+            return False
+
+        slot = self.head % self.slots
+        if self.table['state'][slot] != EMPTY:
+            self._wait_for_slot(slot)
+
+        offset = self.data_offset + slot * self.slot_size
+        np.ndarray(image.shape, dtype=np.uint8, buffer=self.shm.buf, offset=offset)[...] = image
+        offset += image.nbytes
+        self.shm.buf[offset:offset + len(text)] = text
+        offset += len(text)
+        self.shm.buf[offset:offset + len(field_name)] = field_name
+
+        entry = self.table[slot:slot + 1]
+        entry['height'] = image.shape[0]
+        entry['width'] = image.shape[1]
+        entry['channels'] = image.shape[2] if image.ndim == 3 else 0
+        entry['text_len'] = len(text)
+        entry['field_len'] = len(field_name)
+
+        self.head += 1
+        with self.lock:
+            entry['state'] = FULL
+            self.header['head'] = self.head
+            self.header['produced'] += 1
+        return True
+
+    def stats(self):
+        with self.lock:
+            return ring_stats(self.header)
+
+    def close(self):
+        with self.lock:
+            self.header['closed'] = 1
+        self.header = self.table = None
+        self.shm.close()
+        # consumers that are attached keep their mapping and drain what is left
+        self.shm.unlink()
+        self.lock.close()
+        try:
+            os.remove(_lock_path(self.name))
+        except FileNotFoundError:
+            pass
+
+
+class CropRingReader:
+    def __init__(self, name, timeout=None):
+        self.name = name
+        start = time.monotonic()
+        while True:
+            try:
+                self.shm = _attach(name)
+                header = np.ndarray((), dtype=HEADER_DTYPE, buffer=self.shm.buf)
+                if int(header['magic']) == MAGIC:
+                    break
+                del header
+                self.shm.close()
+            except FileNotFoundError:
+                pass
+            if timeout is not None and time.monotonic() - start > timeout:
+                raise TimeoutError(f"No crop ring named {name} appeared within {timeout}s")
+            time.sleep(0.1)
+
+        if int(header['version']) != VERSION:
+            raise ValueError(f"Unsupported crop ring version in {name}: {int(header['version'])}")
+        self.slots = int(header['slots'])
+        self.slot_size = int(header['slot_size'])
+        self.data_offset = _data_offset(self.slots)
+        del header
+        self.header, self.table = _views(self.shm, self.slots)
+        self.lock = _FileLock(_lock_path(name))
+        self.pid = os.getpid()
+        self.claimed = []
+
+    def _sample(self, slot):
+        entry = self.table[slot]
+        offset = self.data_offset + slot * self.slot_size
+        shape = (int(entry['height']), int(entry['width']))
+        if entry['channels']:
+            shape += (int(entry['channels']),)
+        image = np.ndarray(shape, dtype=np.uint8, buffer=self.shm.buf, offset=offset)
+        image.flags.writeable = False
+
+        offset += image.nbytes
+        text = bytes(self.shm.buf[offset:offset + int(entry['text_len'])]).decode('utf-8')
+        offset += int(entry['text_len'])
+        field_name = bytes(self.shm.buf[offset:offset + int(entry['field_len'])]).decode('utf-8')
+        return image, text, field_name
+
+    def read_batch(self, max_items=64, timeout=None):
+        # images are read-only views of ring slots, valid until the next read_batch or release call;
+        # an empty batch means the producer closed the ring and it is drained, or timeout passed
+        self.release()
+        start = time.perf_counter_ns()
+        while True:
+            with self.lock:
+                tail = int(self.header['tail'])
+                count = min(max_items, int(self.header['head']) - tail)
+                if count > 0:
+                    slots = [(tail + k) % self.slots for k in range(count)]
+                    self.table['state'][slots] = CLAIMED
+                    self.table['owner'][slots] = self.pid
+                    self.header['tail'] = tail + count
+                    self.header['consumer_wait_ns'] += time.perf_counter_ns() - start
+                    break
+                if self.header['closed']:
+                    return []
+            if timeout is not None and time.perf_counter_ns() - start > timeout * 1e9:
+                return []
+            time.sleep(POLL_SECONDS)
+
+        self.claimed = slots
+        return [self._sample(slot) for slot in slots]
+
+    def release(self):
+        if not self.claimed:
+            return
+        with self.lock:
+            self.table['state'][self.claimed] = EMPTY
+            self.header['consumed'] += len(self.claimed)
+        self.claimed = []
+
+    def stats(self):
+        with self.lock:
+            return ring_stats(self.header)
+
+    def close(self):
+        self.release()
+        self.header = self.table = None
+        self.shm.close()
+        self.lock.close()
@@ -0,0 +1,156 @@
+import os
+import json
+import tarfile
+import numpy as np
+from .ImageCodec import ImageCodec, decode_image
+from . import profiling
+
+META_FILENAME = 'shards.json'
+INDEX_DTYPE = np.dtype([
+    ('image_offset', '<i8'),
+    ('image_size', '<i8'),
+    ('label_offset', '<i8'),
+    ('label_size', '<i8')
+])
+
+
+def _padded(size):
+    return -(-size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+
+
+def _shard_path(directory, shard_id, ext):
+    return os.path.join(directory, f'shard_{shard_id:05d}{ext}')
+
+
+class ShardWriter:
+    def __init__(self, path, shard_size=10000, count=0, codec=None):
+        self.path = path
+        self.shard_size = shard_size
+        self.codec = codec or ImageCodec()
+        self.image_ext = self.codec.ext
+        self.count = count
+        self.tar = None
+        self.index = None
+        self.position = 0
+        os.makedirs(path, exist_ok=True)
+
+    def _open_shard(self):
+        shard_id, rows = divmod(self.count, self.shard_size)
+        index_path = _shard_path(self.path, shard_id, '.idx')
+
+        end = 0
+        if rows:
+            last = np.fromfile(index_path, dtype=INDEX_DTYPE, count=rows)[-1]
+            end = int(last['label_offset']) + _padded(int(last['label_size']))
+
+        # a shard reopened on resume is cut back to the last checkpointed crop
+        self.tar = open(_shard_path(self.path, shard_id, '.tar'), 'a+b')
+        self.tar.truncate(end)
+        self.index = open(index_path, 'a+b')
+        self.index.truncate(rows * INDEX_DTYPE.itemsize)
+        self.position = end
+
+    def _add_member(self, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mode = 0o644
+        header = info.tobuf(tarfile.USTAR_FORMAT, 'utf-8', 'strict')
+
+        self.tar.write(header)
+        self.tar.write(data)
+        self.tar.write(b'\0' * (_padded(len(data)) - len(data)))
+
+        offset = self.position + len(header)
+        self.position = offset + _padded(len(data))
+        return offset
+
+    def _close_shard(self):
+        self.tar.write(b'\0' * (2 * tarfile.BLOCKSIZE))
+        self.tar.close()
+        self.index.close()
+        self.tar = None
+        self.index = None
+
+    def write(self, data, text):
+        if self.tar is None:
+            self._open_shard()
+
+        with profiling.timer('io.write'):
+            key = f'{self.count:08d}'
+            label = text.encode('utf-8')
+            image_offset = self._add_member(f'{key}{self.image_ext}', data)
+            label_offset = self._add_member(f'{key}.txt', label)
+
+            record = np.array([(image_offset, len(data), label_offset, len(label))], dtype=INDEX_DTYPE)
+            self.index.write(record.tobytes())
+        self.count += 1
+
+        if self.count % self.shard_size == 0:
+            self._close_shard()
+
+    def write_image(self, image, text):
+        # offsets depend on the encoded size, so shards are encoded in order on this thread
+        self.write(self.codec.encode(image), text)
+
+    def checkpoint(self, manifest):
+        if self.tar is not None:
+            for f in (self.tar, self.index):
+                f.flush()
+                os.fsync(f.fileno())
+
+        meta_path = os.path.join(self.path, META_FILENAME)
+        with open(f'{meta_path}.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'shard_size': self.shard_size, 'count': self.count, 'image_ext': self.image_ext}, f, indent=2)
+        os.replace(f'{meta_path}.tmp', meta_path)
+
+        manifest.set_labels_state(self.count, 0)
+        manifest.save()
+
+    def close(self):
+        if self.tar is not None:
+            self._close_shard()
+
+
+class ShardReader:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META_FILENAME), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.shard_size = meta['shard_size']
+        self.count = meta['count']
+        self.image_ext = meta['image_ext']
+        self._shards = {}
+
+    def __len__(self):
+        return self.count
+
+    def _shard(self, shard_id):
+        if shard_id not in self._shards:
+            index = np.fromfile(_shard_path(self.path, shard_id, '.idx'), dtype=INDEX_DTYPE)
+            self._shards[shard_id] = (open(_shard_path(self.path, shard_id, '.tar'), 'rb'), index)
+        return self._shards[shard_id]
+
+    def read(self, i):
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError(f"Crop index {i} out of range for {self.count} crops")
+
+        shard_id, row = divmod(i, self.shard_size)
+        f, index = self._shard(shard_id)
+        record = index[row]
+
+        f.seek(int(record['image_offset']))
+        data = f.read(int(record['image_size']))
+        f.seek(int(record['label_offset']))
+        text = f.read(int(record['label_size'])).decode('utf-8')
+        return data, text
+
+    def __getitem__(self, i):
+        data, text = self.read(i)
+        return decode_image(data, self.image_ext), text
+
+    def close(self):
+        for f, _ in self._shards.values():
+            f.close()
+        self._shards = {}
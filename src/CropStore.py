@@ -0,0 +1,147 @@
+import os
+import json
+import time
+import numpy as np
+from . import profiling
+
+META_FILENAME = 'store.json'
+PIXELS_FILENAME = 'pixels.u8'
+INDEX_FILENAME = 'index.bin'
+LABELS_FILENAME = 'labels.txt'
+INDEX_DTYPE = np.dtype([
+    ('pixel_offset', '<i8'),
+    ('width', '<i8'),
+    ('label_offset', '<i8'),
+    ('label_size', '<i8')
+])
+
+
+def normalize_crop(image, height):
+    import cv2
+
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    h, w = image.shape
+    width = max(1, round(w * height / h))
+    interpolation = cv2.INTER_AREA if height < h else cv2.INTER_LINEAR
+    return cv2.resize(image, (width, height), interpolation=interpolation)
+
+
+class CropNormalizer:
+    # stands in for the crop ImageCodec: "encoding" is the grayscale, fixed-height pixels the store keeps
+    def __init__(self, height=32, label=None):
+        self.height = height
+        self.spec = f'gray:height={height}'
+        self.label = label or self.spec
+
+    def encode(self, image):
+        start = time.perf_counter_ns()
+        data = normalize_crop(image, self.height).tobytes()
+        if profiling.enabled():
+            profiling.add_time(f'io.encode.{self.label}', time.perf_counter_ns() - start)
+            profiling.count(f'io.encode.{self.label}.bytes', len(data))
+            profiling.count(f'io.encode.{self.label}.raw_bytes', image.nbytes)
+        return data
+
+
+class CropStoreWriter:
+    def __init__(self, path, height=32, count=0, normalizer=None):
+        self.path = path
+        self.height = height
+        self.count = count
+        self.normalizer = normalizer or CropNormalizer(height)
+        os.makedirs(path, exist_ok=True)
+
+        pixel_end = label_end = 0
+        index_path = os.path.join(path, INDEX_FILENAME)
+        if count:
+            last = np.fromfile(index_path, dtype=INDEX_DTYPE, count=count)[-1]
+            pixel_end = int(last['pixel_offset']) + height * int(last['width'])
+            label_end = int(last['label_offset']) + int(last['label_size']) + 1
+
+        # files reopened on resume are cut back to the last checkpointed crop
+        self.pixels = open(os.path.join(path, PIXELS_FILENAME), 'a+b')
+        self.pixels.truncate(pixel_end)
+        self.index = open(index_path, 'a+b')
+        self.index.truncate(count * INDEX_DTYPE.itemsize)
+        self.labels = open(os.path.join(path, LABELS_FILENAME), 'a+b')
+        self.labels.truncate(label_end)
+        self.pixel_size = pixel_end
+        self.labels_size = label_end
+
+    def write(self, data, text):
+        # data is a crop from CropNormalizer.encode: height rows of uint8 pixels
+        width = len(data) // self.height
+        label = text.encode('utf-8')
+        with profiling.timer('io.write'):
+            self.pixels.write(data)
+            self.labels.write(label + b'\n')
+            record = np.array([(self.pixel_size, width, self.labels_size, len(label))], dtype=INDEX_DTYPE)
+            self.index.write(record.tobytes())
+        self.pixel_size += len(data)
+        self.labels_size += len(label) + 1
+        self.count += 1
+
+    def write_image(self, image, text):
+        self.write(self.normalizer.encode(image), text)
+
+    def checkpoint(self, manifest):
+        for f in (self.pixels, self.index, self.labels):
+            f.flush()
+            os.fsync(f.fileno())
+
+        meta_path = os.path.join(self.path, META_FILENAME)
+        with open(f'{meta_path}.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'height': self.height, 'count': self.count, 'dtype': 'uint8', 'channels': 1}, f, indent=2)
+        os.replace(f'{meta_path}.tmp', meta_path)
+
+        manifest.set_labels_state(self.count, 0)
+        manifest.save()
+
+    def close(self):
+        for f in (self.pixels, self.index, self.labels):
+            f.close()
+
+
+class CropStoreReader:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META_FILENAME), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.height = meta['height']
+        self.count = meta['count']
+        self.index = np.fromfile(os.path.join(path, INDEX_FILENAME), dtype=INDEX_DTYPE, count=self.count)
+
+        # np.memmap refuses empty files, and a store with no crops has nothing to map
+        self.pixels = self.labels = None
+        if self.count:
+            self.pixels = np.memmap(os.path.join(path, PIXELS_FILENAME), dtype=np.uint8, mode='r')
+            self.labels = np.memmap(os.path.join(path, LABELS_FILENAME), dtype=np.uint8, mode='r')
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def widths(self):
+        return self.index['width']
+
+    def _record(self, i):
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError(f"Crop index {i} out of range for {self.count} crops")
+        return self.index[i]
+
+    def image(self, i):
+        # a read-only view into the memory-mapped pixels; nothing is decoded or copied
+        record = self._record(i)
+        start = int(record['pixel_offset'])
+        return self.pixels[start:start + self.height * int(record['width'])].reshape(self.height, -1)
+
+    def text(self, i):
+        record = self._record(i)
+        start = int(record['label_offset'])
+        return self.labels[start:start + int(record['label_size'])].tobytes().decode('utf-8')
+
+    def __getitem__(self, i):
+        return self.image(i), self.text(i)
@@ -0,0 +1,93 @@
+import os
+import json
+
+
+class DatasetManifest:
+    FILENAME = 'manifest.json'
+    VERSION = 2
+
+    def __init__(self, path, data):
+        self.path = path
+        self.data = data
+
+    @classmethod
+    def create(cls, output_dir, settings, num_images):
+        return cls(os.path.join(output_dir, cls.FILENAME), {
+            'version': cls.VERSION,
+            'settings': settings,
+            'num_images': num_images,
+            'stages': {},
+            'field_count': 0,
+            'labels_size': 0
+        })
+
+    @classmethod
+    def load(cls, output_dir):
+        path = os.path.join(output_dir, cls.FILENAME)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') != cls.VERSION:
+            raise ValueError(f"Unsupported manifest version in {path}: {data.get('version')}")
+        return cls(path, data)
+
+    @property
+    def settings(self):
+        return self.data['settings']
+
+    @property
+    def num_images(self):
+        return self.data['num_images']
+
+    @num_images.setter
+    def num_images(self, value):
+        self.data['num_images'] = value
+
+    @property
+    def field_count(self):
+        return self.data['field_count']
+
+    @property
+    def labels_size(self):
+        return self.data['labels_size']
+
+    def completed_ranges(self, stage):
+        return [tuple(r) for r in self.data['stages'].get(stage, [])]
+
+    def completed_count(self, stage):
+        return sum(end - start for start, end in self.completed_ranges(stage))
+
+    def pending_ranges(self, stage, total=None):
+        total = self.num_images if total is None else total
+        pending = []
+        cursor = 0
+        for start, end in self.completed_ranges(stage):
+            if start > cursor:
+                pending.append((cursor, min(start, total)))
+            cursor = max(cursor, end)
+            if cursor >= total:
+                break
+        if cursor < total:
+            pending.append((cursor, total))
+        return [(start, end) for start, end in pending if end > start]
+
+    def mark_complete(self, stage, start, end):
+        ranges = sorted(self.completed_ranges(stage) + [(start, end)])
+        merged = []
+        for r_start, r_end in ranges:
+            if merged and r_start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], r_end)
+            else:
+                merged.append([r_start, r_end])
+        self.data['stages'][stage] = merged
+
+    def set_labels_state(self, field_count, labels_size):
+        self.data['field_count'] = field_count
+        self.data['labels_size'] = labels_size
+
+    def save(self):
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
@@ -1,11 +1,16 @@
 import cv2
 import json
 import numpy as np
-import albumentations as A
 from pathlib import Path
 import os
 from tqdm import tqdm
 import random
+from collections import Counter
+from .seeding import derive_seed, STAGE_AUGMENT, STAGE_PHOTOMETRIC, STAGE_FIELD_AUGMENT
+from .ImageCodec import ImageCodec, EXTENSIONS, read_image
+from . import profiling
+
+FIELD_MARGIN = 8
 
 
 class IDCardAugmentor:
@@ -15,145 +20,347 @@ class IDCardAugmentor:
 
         self.image_size = image_size
         self.num_augmentations_per_image = num_augmentations_per_image
-        self.transform = self._create_transform()
-
-    def _create_transform(self):
-        bg_color = [random.randint(200, 255) for _ in range(3)]
-
-        return A.Compose([
-            A.Resize(
-                height=int(self.image_size[1] * 0.97),
-                width=int(self.image_size[0] * 0.97),
-                p=1.0
-            ),
-
-            A.PadIfNeeded(
-                min_height=self.image_size[1],
-                min_width=self.image_size[0],
-                border_mode=cv2.BORDER_CONSTANT,
-                fill=bg_color,
-                p=1.0,
-            ),
-
-            A.Rotate(limit=1, p=0.5),
-            A.Perspective(
-                scale=(0.01, 0.02),
-                fit_output=False,
-                keep_size=True,
-                p=0.3,
-            ),
-
-            A.RandomBrightnessContrast(
-                brightness_limit=0.2,
-                contrast_limit=0.2,
-                p=0.5
-            ),
-            A.RGBShift(
-                r_shift_limit=15,
-                g_shift_limit=15,
-                b_shift_limit=15,
-                p=0.3
-            ),
-
-            A.GaussNoise(
-                std_range=[0.1, 0.2],
-                mean_range=[0, 0],
-                per_channel=True,
-                noise_scale_factor=1,
-                p=0.5
-            )
-
-        ], bbox_params=A.BboxParams(
-            format='pascal_voc',
-            min_visibility=0.3,
-            min_area=50,
-            label_fields=['class_ids']
-        ))
-
-    def _validate_bbox(self, bbox, img_width, img_height, min_size=5):
-        x1, y1, x2, y2 = bbox
-
-        width = x2 - x1
-        height = y2 - y1
-
-        if width < min_size or height < min_size:
-            return False, "Too small"
-
-        aspect_ratio = width / max(height, 1)
-        if aspect_ratio > 30 or aspect_ratio < 0.03:
-            return False, f"Bad aspect ratio: {aspect_ratio:.2f}"
+        self.stats = Counter()
+        self._warned_exception = False
+
+        # Resize(97%) + centered PadIfNeeded, fixed for every sample
+        width, height = image_size
+        self.inner_size = (int(width * 0.97), int(height * 0.97))
+        self.offset = ((width - self.inner_size[0]) // 2, (height - self.inner_size[1]) // 2)
+
+    def _sample_geometry(self, rng, size=None):
+        # Rotate(limit=1, p=0.5) and Perspective(scale=(0.01, 0.02), p=0.3) as one homography
+        width, height = size or self.image_size
+        matrix = None
+
+        if rng.random() < 0.5:
+            rotation = cv2.getRotationMatrix2D((width / 2 - 0.5, height / 2 - 0.5), rng.uniform(-1, 1), 1.0)
+            matrix = np.vstack([rotation, [0, 0, 1]])
+
+        if rng.random() < 0.3:
+            jitter = np.mod(np.abs(rng.normal(0, rng.uniform(0.01, 0.02), (4, 2))), 0.32)
+            quad = np.array([
+                [jitter[0, 0], jitter[0, 1]],
+                [1 - jitter[1, 0], jitter[1, 1]],
+                [1 - jitter[2, 0], 1 - jitter[2, 1]],
+                [jitter[3, 0], 1 - jitter[3, 1]]
+            ]) * (width, height)
+            corners = np.array([[0, 0], [width, 0], [width, height], [0, height]])
+            perspective = cv2.getPerspectiveTransform(quad.astype(np.float32), corners.astype(np.float32))
+            matrix = perspective if matrix is None else perspective @ matrix
+
+        return matrix
+
+    def _place_bboxes(self, bboxes):
+        bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+        scale = (self.inner_size[0] / self.image_size[0], self.inner_size[1] / self.image_size[1])
+        return bboxes * (scale * 2) + (self.offset * 2)
+
+    def _transform_bboxes(self, bboxes, matrix):
+        if matrix is None:
+            return bboxes.copy()
+
+        # (x1, y1), (x2, y1), (x2, y2), (x1, y2) of every box
+        corners = bboxes[:, [0, 1, 2, 1, 2, 3, 0, 3]]
+        points = cv2.perspectiveTransform(corners.reshape(-1, 1, 2), matrix).reshape(-1, 4, 2)
+        return np.concatenate([points.min(axis=1), points.max(axis=1)], axis=1)
+
+    def _rejection_reason(self, bboxes, size=None, min_visibility=0.3, min_area=50, min_size=5):
+        width, height = size or self.image_size
+        box_w = bboxes[:, 2] - bboxes[:, 0]
+        box_h = bboxes[:, 3] - bboxes[:, 1]
+        area = box_w * box_h
+
+        np.clip(bboxes, 0, (width, height, width, height), out=bboxes)
+        np.subtract(bboxes[:, 2], bboxes[:, 0], out=box_w)
+        np.subtract(bboxes[:, 3], bboxes[:, 1], out=box_h)
+        clipped_area = box_w * box_h
+
+        if (clipped_area < min_area).any() or (clipped_area < min_visibility * area).any():
+            return 'dropped'
+        if (box_w < min_size).any() or (box_h < min_size).any():
+            return 'too_small'
+        aspect = box_w / np.maximum(box_h, 1)
+        if (aspect > 30).any() or (aspect < 0.03).any():
+            return 'aspect_ratio'
+        return None
+
+    def _warp(self, resized, fill, matrix):
+        width, height = self.image_size
+        left, top = self.offset
+        canvas = cv2.copyMakeBorder(resized, top, height - resized.shape[0] - top, left,
+                                    width - resized.shape[1] - left, cv2.BORDER_CONSTANT, value=fill)
+
+        if matrix is None:
+            return canvas
+        return cv2.warpPerspective(canvas, matrix, self.image_size, flags=cv2.INTER_LINEAR,
+                                   borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+
+    def _photometric_params(self, rng):
+        # RandomBrightnessContrast(0.2, 0.2, p=0.5), RGBShift(15, 15, 15, p=0.3), GaussNoise(std 0.1-0.2, p=0.5)
+        alpha, beta = 1.0, 0.0
+        if rng.random() < 0.5:
+            alpha = 1.0 + rng.uniform(-0.2, 0.2)
+            beta = rng.uniform(-0.2, 0.2) * 255
+
+        shift = np.zeros(3)
+        if rng.random() < 0.3:
+            shift = rng.uniform(-15, 15, 3)
+
+        noise = None
+        if rng.random() < 0.5:
+            sigma = rng.uniform(0.1, 0.2) * 255
+            noise = (sigma, int(rng.integers(2 ** 31)))
+        return alpha, beta, shift, noise
+
+    def apply_photometric(self, images, seeds):
+        if not images:
+            return []
+
+        params = [self._photometric_params(np.random.default_rng(seed)) for seed in seeds]
+        alpha = np.array([p[0] for p in params], dtype=np.float32)[:, None, None]
+        beta = np.array([p[1] for p in params], dtype=np.float32)[:, None, None]
+        shift = np.array([p[2] for p in params], dtype=np.float32)[:, None, :]
+
+        # brightness/contrast and channel shift with their clips, as one (256, 3) table per image
+        levels = np.arange(256, dtype=np.float32)[None, :, None]
+        luts = np.clip(np.clip(levels * alpha + beta, 0, 255) + shift, 0, 255)
+
+        identity = (alpha.ravel() == 1) & (beta.ravel() == 0) & ~shift.reshape(len(params), 3).any(axis=1)
+
+        results = []
+        for image, lut, is_identity, (_, _, _, noise) in zip(images, luts, identity, params):
+            if noise is None:
+                results.append(image if is_identity else cv2.LUT(image, np.rint(lut).astype(np.uint8)[:, None, :]))
+                continue
 
-        if x1 < 0 or y1 < 0 or x2 > img_width or y2 > img_height:
-            return False, "Out of bounds"
+            sigma, noise_seed = noise
+            # the +0.5 makes the final truncating cast round to nearest
+            if is_identity:
+                out = image.astype(np.float32)
+                out += 0.5
+            else:
+                out = cv2.LUT(image, (lut + 0.5)[:, None, :])
+            # fresh noise for every image, seeded from its own parameters; OpenCV's generator is
+            # per thread and about twice as fast as NumPy's for float32 fields
+            field = np.empty_like(out)
+            cv2.setRNGSeed(noise_seed)
+            cv2.randn(field, 0, (sigma,) * out.shape[2])
+            out += field
+            np.clip(out, 0.5, 255.5, out=out)
+            results.append(out.astype(np.uint8))
+        return results
+
+    def augment_seeds(self, seed, sample_index, aug_indices=None):
+        if aug_indices is None:
+            aug_indices = range(self.num_augmentations_per_image)
+        return [derive_seed(seed, STAGE_AUGMENT, sample_index, k) for k in aug_indices]
+
+    def _augment_seeded(self, resized, placed_bboxes, seed, max_attempts=3):
+        rng = np.random.default_rng(seed)
+        fill = [int(c) for c in rng.integers(200, 256, 3)]
+
+        for _ in range(max_attempts):
+            self.stats['attempts'] += 1
+            try:
+                with profiling.timer('augment.geometry'):
+                    matrix = self._sample_geometry(rng)
+                    bboxes = self._transform_bboxes(placed_bboxes, matrix)
+                    reason = self._rejection_reason(bboxes)
+                if reason is not None:
+                    self.stats[f'rejected_{reason}'] += 1
+                    profiling.count('augment_retries')
+                    continue
+                with profiling.timer('augment.warp'):
+                    image = self._warp(resized, fill, matrix)
+            except Exception as e:
+                self.stats['exceptions'] += 1
+                if not self._warned_exception:
+                    print(f"Warning: Augmentation attempt failed: {e}")
+                    self._warned_exception = True
+                continue
 
-        return True, "OK"
+            self.stats['accepted'] += 1
+            return image, bboxes.tolist()
 
-    def augment_image(self, image, bboxes, class_ids, class_names, texts):
-        augmented_images = []
-        augmented_bboxes_list = []
-        augmented_class_names_list = []
-        augmented_texts_list = []
+        self.stats['shortfall'] += 1
+        return None
 
-        attempts = 0
-        max_attempts = self.num_augmentations_per_image * 3
+    def field_seeds(self, seed, sample_index, class_id, count):
+        return [derive_seed(seed, STAGE_FIELD_AUGMENT, sample_index, class_id, k) for k in range(count)]
 
-        while len(augmented_images) < self.num_augmentations_per_image and attempts < max_attempts:
-            attempts += 1
+    def _augment_field_seeded(self, patch, field_bbox, margin, seed, max_attempts=3):
+        rng = np.random.default_rng(seed)
+        size = patch.shape[:2][::-1]
 
+        for _ in range(max_attempts):
+            self.stats['attempts'] += 1
             try:
-                transformed = self.transform(
-                    image=image,
-                    bboxes=bboxes,
-                    class_ids=class_ids
-                )
+                with profiling.timer('augment.geometry'):
+                    matrix = self._sample_geometry(rng, size)
+                    bbox = self._transform_bboxes(field_bbox, matrix)
+                    # loosen or tighten each side of the crop, like an imprecise text detector
+                    bbox += rng.uniform(-margin / 2, margin / 2, (1, 4))
+                    reason = self._rejection_reason(bbox, size)
+                if reason is not None:
+                    self.stats[f'rejected_{reason}'] += 1
+                    profiling.count('augment_retries')
+                    continue
+                with profiling.timer('augment.warp'):
+                    x1, y1, x2, y2 = (int(v) for v in bbox[0])
+                    if matrix is None:
+                        crop = patch[y1:y2, x1:x2].copy()
+                    else:
+                        # warp straight into the crop; the card surface continues past the patch edges
+                        shift = np.array([[1, 0, -x1], [0, 1, -y1], [0, 0, 1]], dtype=np.float64)
+                        crop = cv2.warpPerspective(patch, shift @ matrix, (x2 - x1, y2 - y1),
+                                                   flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+            except Exception as e:
+                self.stats['exceptions'] += 1
+                if not self._warned_exception:
+                    print(f"Warning: Augmentation attempt failed: {e}")
+                    self._warned_exception = True
+                continue
 
-                h, w = transformed['image'].shape[:2]
-                all_valid = True
+            self.stats['accepted'] += 1
+            return crop
+
+        self.stats['shortfall'] += 1
+        return None
+
+    def augment_fields(self, image, fields, margin=FIELD_MARGIN):
+        # fields are (bbox, seeds) pairs; only each field plus margin pixels of card around it
+        # is warped and recoloured, and the card's crops share one photometric batch
+        height, width = image.shape[:2]
+        crops = []
+        owners = []
+        photometric_seeds = []
+
+        for field_index, (bbox, seeds) in enumerate(fields):
+            self.stats['requested'] += len(seeds)
+            x1, y1, x2, y2 = bbox
+            left, top = max(0, int(x1) - margin), max(0, int(y1) - margin)
+            right, bottom = min(width, int(np.ceil(x2)) + margin), min(height, int(np.ceil(y2)) + margin)
+            if right <= left or bottom <= top:
+                self.stats['shortfall'] += len(seeds)
+                continue
 
-                if len(transformed['bboxes']) != len(bboxes):
-                    continue
+            patch = image[top:bottom, left:right]
+            field_bbox = np.array([[x1 - left, y1 - top, x2 - left, y2 - top]], dtype=np.float64)
+            for seed in seeds:
+                crop = self._augment_field_seeded(patch, field_bbox, margin, seed)
+                if crop is not None:
+                    crops.append(crop)
+                    owners.append(field_index)
+                    photometric_seeds.append(derive_seed(seed, STAGE_PHOTOMETRIC))
 
-                for bbox in transformed['bboxes']:
-                    is_valid, msg = self._validate_bbox(bbox, w, h)
-                    if not is_valid:
-                        all_valid = False
-                        break
+        with profiling.timer('augment.photometric'):
+            crops = self.apply_photometric(crops, photometric_seeds)
 
-                if all_valid:
-                    augmented_images.append(transformed['image'])
-                    augmented_bboxes_list.append(transformed['bboxes'])
-                    augmented_class_names_list.append(class_names)
-                    augmented_texts_list.append(texts)
+        results = [[] for _ in fields]
+        for field_index, crop in zip(owners, crops):
+            results[field_index].append(crop)
+        return results
 
-            except Exception as e:
-                continue
+    def take_stats(self):
+        stats, self.stats = self.stats, Counter()
+        return stats
+
+    def augment_image(self, image, bboxes, class_ids, class_names, texts, seeds=None):
+        if seeds is None:
+            seeds = [random.getrandbits(64) for _ in range(self.num_augmentations_per_image)]
 
+        augmented_images = []
+        augmented_bboxes_list = []
+        augmented_class_names_list = []
+        augmented_texts_list = []
+        photometric_seeds = []
+
+        self.stats['requested'] += len(seeds)
+        with profiling.timer('augment.resize'):
+            resized = cv2.resize(image, self.inner_size)
+        placed_bboxes = self._place_bboxes(bboxes)
+
+        for seed in seeds:
+            result = self._augment_seeded(resized, placed_bboxes, seed)
+            if result is not None:
+                augmented_images.append(result[0])
+                augmented_bboxes_list.append(result[1])
+                augmented_class_names_list.append(class_names)
+                augmented_texts_list.append(texts)
+                photometric_seeds.append(derive_seed(seed, STAGE_PHOTOMETRIC))
+
+        with profiling.timer('augment.photometric'):
+            augmented_images = self.apply_photometric(augmented_images, photometric_seeds)
         return augmented_images, augmented_bboxes_list, augmented_class_names_list, augmented_texts_list
 
-    def _save_augmented_data(self, image, bboxes, class_ids, class_names, texts, output_name, output_images_dir,
-                             output_labels_dir):
+    def augment_boxes(self, image, boxes, seeds=None):
+        if image.shape[:2][::-1] != self.image_size:
+            image = cv2.resize(image, self.image_size)
 
+        bboxes = [box['bbox'] for box in boxes]
+        class_ids = [box['class_id'] for box in boxes]
+        class_names = [box['class_name'] for box in boxes]
+        texts = [box.get('text', '') for box in boxes]
+
+        aug_images, aug_bboxes_list, aug_class_names_list, aug_texts_list = self.augment_image(
+            image,
+            bboxes,
+            class_ids,
+            class_names,
+            texts,
+            seeds=seeds
+        )
+
+        results = []
+        for aug_img, aug_bboxes, aug_class_names, aug_texts in zip(
+                aug_images, aug_bboxes_list, aug_class_names_list, aug_texts_list
+        ):
+            aug_img, aug_bboxes = self._fit_to_size(aug_img, aug_bboxes)
+            results.append((aug_img, [
+                {
+                    'class_id': int(class_id),
+                    'class_name': class_name,
+                    'bbox': [float(x) for x in bbox],
+                    'text': text
+                }
+                for bbox, class_id, class_name, text in zip(aug_bboxes, class_ids, aug_class_names, aug_texts)
+            ]))
+        return results
+
+    def _fit_to_size(self, image, bboxes):
         h, w = image.shape[:2]
-        if (w, h) != self.image_size:
-            scale_x = self.image_size[0] / w
-            scale_y = self.image_size[1] / h
+        if (w, h) == self.image_size:
+            return image, bboxes
+
+        scale_x = self.image_size[0] / w
+        scale_y = self.image_size[1] / h
+
+        image = cv2.resize(image, self.image_size)
+
+        scaled_bboxes = []
+        for bbox in bboxes:
+            x1, y1, x2, y2 = bbox
+            scaled_bbox = [
+                x1 * scale_x,
+                y1 * scale_y,
+                x2 * scale_x,
+                y2 * scale_y
+            ]
+            scaled_bboxes.append(scaled_bbox)
+        return image, scaled_bboxes
 
-            image = cv2.resize(image, self.image_size)
+    def _save_augmented_data(self, image, bboxes, class_ids, class_names, texts, output_name, output_images_dir,
+                             output_labels_dir, writer=None, codec=None):
 
-            scaled_bboxes = []
-            for bbox in bboxes:
-                x1, y1, x2, y2 = bbox
-                scaled_bbox = [
-                    x1 * scale_x,
-                    y1 * scale_y,
-                    x2 * scale_x,
-                    y2 * scale_y
-                ]
-                scaled_bboxes.append(scaled_bbox)
-            bboxes = scaled_bboxes
-
-        img_path = f'{output_images_dir}/{output_name}.jpg'
-        cv2.imwrite(img_path, image)
+        image, bboxes = self._fit_to_size(image, bboxes)
+
+        codec = codec or ImageCodec()
+        img_path = f'{output_images_dir}/{output_name}{codec.ext}'
+        if writer is not None:
+            writer.write_image(img_path, image, codec)
+        else:
+            codec.write(img_path, image)
 
         label_path = f'{output_labels_dir}/{output_name}.json'
         label_data = {
@@ -169,18 +376,41 @@ class IDCardAugmentor:
                 'text': text
             })
 
+        if writer is not None:
+            writer.write_json(label_path, label_data)
+            return
+
         with open(label_path, 'w', encoding='utf-8') as f:
             json.dump(label_data, f, ensure_ascii=False, indent=2)
 
-    def process_files(self, image_files, output_dir):
+    def save_augmentations(self, image, boxes, seeds, base_name, output_images_dir, writer=None, codec=None):
+        codec = codec or ImageCodec()
+        records = []
+        for aug_idx, (aug_img, aug_boxes) in enumerate(self.augment_boxes(image, boxes, seeds=seeds)):
+            image_name = f'{base_name}_aug_{aug_idx:03d}{codec.ext}'
+            img_path = f'{output_images_dir}/{image_name}'
+            if writer is not None:
+                writer.write_image(img_path, aug_img, codec)
+            else:
+                codec.write(img_path, aug_img)
+
+            records.append({
+                'image': image_name,
+                'image_size': {'width': aug_img.shape[1], 'height': aug_img.shape[0]},
+                'boxes': aug_boxes
+            })
+        return records
+
+    def process_files(self, image_files, output_dir, show_progress=True, seed=None, start_index=0, writer=None,
+                      codec=None):
         output_images_dir = f'{output_dir}/images'
         output_labels_dir = f'{output_dir}/labels_bbox'
 
         os.makedirs(output_images_dir, exist_ok=True)
         os.makedirs(output_labels_dir, exist_ok=True)
 
-        for img_path in tqdm(image_files, desc="Augmenting"):
-            image = cv2.imread(str(img_path))
+        for file_idx, img_path in enumerate(tqdm(image_files, desc="Augmenting", disable=not show_progress)):
+            image = read_image(str(img_path))
 
             if image is None:
                 continue
@@ -207,7 +437,8 @@ class IDCardAugmentor:
                 bboxes,
                 class_ids,
                 class_names,
-                texts
+                texts,
+                seeds=None if seed is None else self.augment_seeds(seed, start_index + file_idx)
             )
 
             base_name = img_path.stem
@@ -223,18 +454,19 @@ class IDCardAugmentor:
                     aug_texts,
                     output_name,
                     output_images_dir,
-                    output_labels_dir
+                    output_labels_dir,
+                    writer,
+                    codec
                 )
 
-    def process_dataset(self, input_images_dir, output_dir):
+    def process_dataset(self, input_images_dir, output_dir, codec=None):
         output_images_dir = f'{output_dir}/images'
         output_labels_dir = f'{output_dir}/labels_bbox'
 
         os.makedirs(output_images_dir, exist_ok=True)
         os.makedirs(output_labels_dir, exist_ok=True)
 
-        image_files = list(Path(input_images_dir).glob('*.jpg'))
-        image_files += list(Path(input_images_dir).glob('*.png'))
+        image_files = [path for ext in EXTENSIONS.values() for path in Path(input_images_dir).glob(f'*{ext}')]
 
         if len(image_files) == 0:
             print(f"Error: No images found in {input_images_dir}")
@@ -243,7 +475,7 @@ class IDCardAugmentor:
         total_generated = 0
 
         for img_idx, img_path in enumerate(tqdm(image_files, desc="Processing images")):
-            image = cv2.imread(str(img_path))
+            image = read_image(str(img_path))
 
             if image is None:
                 continue
@@ -286,6 +518,7 @@ class IDCardAugmentor:
                     aug_texts,
                     output_name,
                     output_images_dir,
-                    output_labels_dir
+                    output_labels_dir,
+                    codec=codec
                 )
                 total_generated += 1
\ No newline at end of file
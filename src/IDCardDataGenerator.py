@@ -1,32 +1,86 @@
 import random
-from pythainlp.transliterate import romanize
-from typing import Dict, List
+import os
+import numpy as np
+from functools import lru_cache
+from typing import Dict, List, Optional
 from . import constants
+from .AddressIndex import AddressIndex
+from . import profiling
 from datetime import datetime, timedelta
 import json
 from dateutil.relativedelta import relativedelta
 
+
+_failed_romanize_engines = set()
+
+
+@lru_cache(maxsize=4096)
+def _romanize_name(thai_name: str) -> str:
+    from pythainlp.transliterate import romanize
+
+    profiling.count('romanize_calls')
+    for engine in ('thai2rom', 'thai2rom_onnx', 'royin'):
+        try:
+            return romanize(thai_name, engine=engine).capitalize()
+        except Exception as e:
+            profiling.count(f'romanize_{engine}_failures')
+            if engine not in _failed_romanize_engines:
+                _failed_romanize_engines.add(engine)
+                print(f"Warning: Romanization engine {engine} failed ({e}), falling back to the next engine")
+    return thai_name
+
+
+class IDCardBatch:
+    def __init__(self, columns: Dict[str, np.ndarray]):
+        self.columns = columns
+
+    def __len__(self):
+        return len(next(iter(self.columns.values())))
+
+    def __getitem__(self, key: str) -> np.ndarray:
+        return self.columns[key]
+
+    def row(self, i: int) -> dict:
+        return {key: column[i] if column.dtype == object else column[i].item()
+                for key, column in self.columns.items()}
+
+    def rows(self):
+        for i in range(len(self)):
+            yield self.row(i)
+
+
 class IDCardDataGenerator:
+    RELIGION_NAMES = [r[0] for r in constants.RELIGIONS]
+    RELIGION_WEIGHTS = [r[1] for r in constants.RELIGIONS]
+    RELIGION_P = np.asarray(RELIGION_WEIGHTS) / sum(RELIGION_WEIGHTS)
+    ID_CHECKSUM_WEIGHTS = np.arange(13, 1, -1)
+
     def __init__(self, 
             male_names_path='../datasets/thai-names-corpus/male_names_th.txt',
             female_names_path='../datasets/thai-names-corpus/female_names_th.txt',
             family_names_path='../datasets/thai-names-corpus/family_names_th.txt',
             address_data_path='../datasets/thai-province/province_with_district_and_sub_district.json',
-            streets_data_path='../datasets/thai-province/thai_streets_all.json'):
+            streets_data_path='../datasets/thai-province/thai_streets_all.json',
+            romanization_table_path='../datasets/thai-names-corpus/romanized_names.tsv',
+            address_index_path: Optional[str] = None,
+            address_weighting: str = 'province',
+            province_weights: Optional[Dict[str, float]] = None,
+            current_date: Optional[datetime] = None):
         self.male_names = self._load_names(male_names_path)
         self.female_names = self._load_names(female_names_path)
         self.family_names = self._load_names(family_names_path)
-        self.current_date = datetime.now()
-        self.address_data = self._load_address_data(address_data_path)
+        self.current_date = current_date or datetime.now()
+        self.address_index = AddressIndex.load(
+            address_data_path,
+            cache_path=address_index_path,
+            weighting=address_weighting,
+            province_weights=province_weights
+        )
         self.streets_data = self._load_streets_data(streets_data_path)
-
-    def _load_address_data(self, filepath: str):
-        try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"Warning: Could not load address data: {e}")
-            return []
+        self.street_fragments = self._build_street_fragments(self.streets_data)
+        self._date_tables = None
+        self._name_arrays = None
+        self.romanization_table = self._load_romanization_table(romanization_table_path)
 
     def _load_names(self, filepath: str) -> List[str]:
         try:
@@ -45,47 +99,80 @@ class IDCardDataGenerator:
             print(f"Warning: Could not load streets data: {e}")
             return {}
 
-    def _transliterate_name(self, thai_name: str) -> str:
-        try:
-            english = romanize(thai_name, engine='thai2rom')
-            return english.capitalize()
-        except:
-            pass
-        
-        try:
-            english = romanize(thai_name, engine='thai2rom_onnx')
-            return english.capitalize()
-        except:
-            pass
-        
+    def _load_romanization_table(self, filepath: str) -> Dict[str, str]:
+        if not filepath:
+            return {}
+        if not os.path.exists(filepath):
+            print(f"Warning: Romanization table {filepath} not found, every name is romanized at runtime; "
+                  f"run build_romanization_table.py to rebuild it")
+            return {}
         try:
-            english = romanize(thai_name, engine='royin')
-            return english.capitalize()
+            with open(filepath, 'r', encoding='utf-8') as f:
+                return dict(line.rstrip('\n').split('\t', 1) for line in f if '\t' in line)
         except Exception as e:
-            # print(f"Warning: Could not transliterate '{thai_name}': {e}")
-            return thai_name
-        
+            print(f"Warning: Could not load romanization table: {e}")
+            return {}
+
+    @staticmethod
+    def build_romanization_table(names_paths: List[str], output_path: str, show_progress: bool = True) -> int:
+        from pythainlp.transliterate import romanize
+        from tqdm import tqdm
+
+        names = set()
+        for filepath in names_paths:
+            with open(filepath, 'r', encoding='utf-8') as f:
+                names.update(line.strip() for line in f if line.strip())
+
+        # only thai2rom output goes into the table; a model that fails to load is an error, not a fallback
+        tmp_path = f'{output_path}.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for name in tqdm(sorted(names), desc="Romanizing names", disable=not show_progress):
+                    f.write(f"{name}\t{romanize(name, engine='thai2rom').capitalize()}\n")
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        os.replace(tmp_path, output_path)
+        return len(names)
+
+    def _build_street_fragments(self, streets_data) -> Dict[str, List[str]]:
+        fragments = {}
+        for province_name_th, province_streets in (streets_data or {}).items():
+            streets_list = province_streets.get('all_streets', [])
+            if streets_list:
+                fragments[province_name_th] = [
+                    f" {street.replace('ซอย', 'ซ.').replace('ถนน', 'ถ.')}" for street in streets_list
+                ]
+        return fragments
+
+    def _transliterate_name(self, thai_name: str) -> str:
+        english = self.romanization_table.get(thai_name)
+        if english is None:
+            profiling.count('romanization_table_misses')
+            english = _romanize_name(thai_name)
+        return english
+
     def generate_name(self, gender: str = 'random', 
-        marital_status: str = 'random') -> Dict[str, str]:
+        marital_status: str = 'random', rng=random) -> Dict[str, str]:
 
         if gender == 'random':
-            gender = random.choice(['male', 'female'])
+            gender = rng.choice(['male', 'female'])
 
         if gender == 'male':
-            first_name = random.choice(self.male_names)
+            first_name = rng.choice(self.male_names)
             title_prefix = constants.TITLE_PREFIXES['male']
         else:
-            first_name = random.choice(self.female_names)
+            first_name = rng.choice(self.female_names)
 
             if marital_status == 'random':
-                marital_status = random.choice(['single', 'married'])
+                marital_status = rng.choice(['single', 'married'])
             
             if marital_status == 'married':
                 title_prefix = constants.TITLE_PREFIXES['female_married']
             else:
                 title_prefix = constants.TITLE_PREFIXES['female_single']
 
-        last_name = random.choice(self.family_names)
+        last_name = rng.choice(self.family_names)
 
         full_name_th = f"{title_prefix['th']} {first_name} {last_name}"
 
@@ -117,10 +204,10 @@ class IDCardDataGenerator:
     def print_name_example(self, name_dict: Dict[str, str]):
         print(f"{name_dict['FullNameTH']}, {name_dict['NameEN']} {name_dict['LastNameEN']}")
 
-    def _random_date_between(self, start_date: datetime, end_date: datetime) -> datetime:
+    def _random_date_between(self, start_date: datetime, end_date: datetime, rng=random) -> datetime:
         time_between = end_date - start_date
         days_between = time_between.days
-        random_days = random.randint(0, days_between)
+        random_days = rng.randint(0, days_between)
         return start_date + timedelta(days=random_days)
     
     def _format_thai_date(self, date: datetime, use_short_month: bool = True) -> str:
@@ -141,14 +228,15 @@ class IDCardDataGenerator:
     def generate_dates(self, 
                   age_range: tuple = (18, 85),
                   issue_years_ago_range: tuple = (0, 10),
-                  card_validity_years: int = 10) -> dict:
+                  card_validity_years: int = 10,
+                  rng=random) -> dict:
         
         min_age, max_age = age_range
         
         max_birth_date = self.current_date - timedelta(days=min_age * 365.25)
         min_birth_date = self.current_date - timedelta(days=max_age * 365.25)
         
-        birth_date = self._random_date_between(min_birth_date, max_birth_date)
+        birth_date = self._random_date_between(min_birth_date, max_birth_date, rng)
         
         earliest_issue = birth_date + timedelta(days=18 * 365.25)
         
@@ -161,7 +249,7 @@ class IDCardDataGenerator:
         if actual_earliest_issue > latest_issue:
             issue_date = latest_issue
         else:
-            issue_date = self._random_date_between(actual_earliest_issue, latest_issue)
+            issue_date = self._random_date_between(actual_earliest_issue, latest_issue, rng)
 
         expiry_date = issue_date + relativedelta(years=card_validity_years)
         
@@ -181,9 +269,9 @@ class IDCardDataGenerator:
         }
 
     @staticmethod
-    def generate_thai_id(formatted=False):
-        digits = [random.randint(1, 9)]
-        digits.extend([random.randint(0, 9) for _ in range(11)])
+    def generate_thai_id(formatted=False, rng=random):
+        digits = [rng.randint(1, 9)]
+        digits.extend([rng.randint(0, 9) for _ in range(11)])
         
         total = sum(d * (13 - i) for i, d in enumerate(digits))
         checksum = (11 - (total % 11)) % 10
@@ -208,60 +296,24 @@ class IDCardDataGenerator:
         
         return int(id_clean[12]) == expected_checksum
     
-    def generate_religion(self) -> str:
-        religions = [
-            ('พุทธ', 94.0),
-            ('อิสลาม', 5.0),
-            ('คริสต์', 0.7),
-            ('ฮินดู', 0.2),
-            ('ซิกข์', 0.1)
-        ]
-        
-        religion_names = [r[0] for r in religions]
-        religion_weights = [r[1] for r in religions]
-        
-        return random.choices(religion_names, weights=religion_weights)[0]
+    def generate_religion(self, rng=random) -> str:
+        return rng.choices(self.RELIGION_NAMES, weights=self.RELIGION_WEIGHTS)[0]
 
-    def generate_address(self) -> dict:
-        if not self.address_data:
+    def generate_address(self, rng=random) -> dict:
+        if self.address_index is None:
             return {'Address': 'บ้านเลขที่ 123 ถนนสุขุมวิท แขวงคลองเตย เขตคลองเตย กรุงเทพมหานคร'}
 
-        province = random.choice(self.address_data)
-        province_name_th = province['name_th']
+        leaf = self.address_index.sample(rng)
+        province_name_th, district_name_th, sub_district_name_th, fragment = self.address_index.parts(leaf)
 
-        if not province.get('districts'):
-            district_name_th = ""
-            sub_district_name_th = ""
-        else:
-            district = random.choice(province['districts'])
-            district_name_th = district['name_th']
-
-            if not district.get('sub_districts'):
-                sub_district_name_th = ""
-            else:
-                sub_district = random.choice(district['sub_districts'])
-                sub_district_name_th = sub_district['name_th']
-
-        house_number = self._generate_house_number()
+        house_number = self._generate_house_number(rng)
 
         street = ""
-        if self.streets_data and province_name_th in self.streets_data:
-            streets_list = self.streets_data[province_name_th].get('all_streets', [])
-            if streets_list:
-                selected_street = random.choice(streets_list)
-                selected_street = selected_street.replace('ซอย', 'ซ.')
-                selected_street = selected_street.replace('ถนน', 'ถ.')
-                street = f" {selected_street}"
-
-        is_bangkok = province_name_th == "กรุงเทพมหานคร"
+        streets_list = self.street_fragments.get(province_name_th)
+        if streets_list:
+            street = rng.choice(streets_list)
 
-        if is_bangkok:
-            district_prefix = "" if district_name_th.startswith("เขต") else "เขต"
-            address = f"{house_number}{street} แขวง{sub_district_name_th} {district_prefix}{district_name_th} {province_name_th}"
-        else:
-            tambon = f" ต.{sub_district_name_th}" if sub_district_name_th else ""
-            amphoe = f" อ.{district_name_th}" if district_name_th else ""
-            address = f"{house_number}{street}{tambon}{amphoe} จ.{province_name_th}"
+        address = f"{house_number}{street}{fragment}"
 
         return {
             'Address': address.strip(),
@@ -271,30 +323,35 @@ class IDCardDataGenerator:
             '_house_number': house_number
         }
 
-    def _generate_house_number(self) -> str:
+    def _generate_house_number(self, rng=random) -> str:
         # รูปแบบต่างๆ
         formats = [
-            lambda: str(random.randint(1, 999)),  # 123
-            lambda: f"{random.randint(1, 999)}/{random.randint(1, 99)}",  # 123/45
-            lambda: f"{random.randint(1, 99)}/{random.randint(1, 9)}",  # 12/3
+            lambda: str(rng.randint(1, 999)),  # 123
+            lambda: f"{rng.randint(1, 999)}/{rng.randint(1, 99)}",  # 123/45
+            lambda: f"{rng.randint(1, 99)}/{rng.randint(1, 9)}",  # 12/3
         ]
         
-        return random.choice(formats)()
+        return rng.choice(formats)()
     
     def generate(self, 
         gender: str = 'random',
         marital_status: str = 'random',
-        age_range: tuple = (18, 85)) -> dict:
+        age_range: tuple = (18, 85),
+        rng=random) -> dict:
         
-        name_data = self.generate_name(gender, marital_status)
+        with profiling.timer('generate.name'):
+            name_data = self.generate_name(gender, marital_status, rng)
         
-        date_data = self.generate_dates(age_range=age_range)
+        with profiling.timer('generate.dates'):
+            date_data = self.generate_dates(age_range=age_range, rng=rng)
 
-        id_number = self.generate_thai_id(formatted=True)
+        with profiling.timer('generate.id'):
+            id_number = self.generate_thai_id(formatted=True, rng=rng)
 
-        religion = self.generate_religion()
+        religion = self.generate_religion(rng)
 
-        address_data = self.generate_address()
+        with profiling.timer('generate.address'):
+            address_data = self.generate_address(rng)
         
         return {
             **name_data,
@@ -303,4 +360,186 @@ class IDCardDataGenerator:
             'Identification_Number': id_number,
             '_id_number_raw': id_number.replace(' ', ''),
             'Religion': religion,
-        }
\ No newline at end of file
+        }
+
+    @staticmethod
+    def generate_thai_ids(n: int, rng: np.random.Generator, formatted: bool = False) -> np.ndarray:
+        digits = np.empty((n, 13), dtype=np.int64)
+        digits[:, 0] = rng.integers(1, 10, n)
+        digits[:, 1:12] = rng.integers(0, 10, (n, 11))
+        total = digits[:, :12] @ IDCardDataGenerator.ID_CHECKSUM_WEIGHTS
+        digits[:, 12] = (11 - total % 11) % 10
+
+        chars = (digits + ord('0')).astype(np.uint8)
+        if formatted:
+            spaced = np.full((n, 17), ord(' '), dtype=np.uint8)
+            spaced[:, [0, 2, 3, 4, 5, 7, 8, 9, 10, 11, 13, 14, 16]] = chars
+            chars = spaced
+        width = chars.shape[1]
+        return np.ascontiguousarray(chars).view(f'S{width}').ravel().astype(f'U{width}').astype(object)
+
+    def _get_name_arrays(self):
+        if self._name_arrays is None:
+            self._name_arrays = (
+                np.asarray(self.male_names, dtype=object),
+                np.asarray(self.female_names, dtype=object),
+                np.asarray(self.family_names, dtype=object)
+            )
+        return self._name_arrays
+
+    def _get_date_tables(self, start_day: int, end_day: int):
+        tables = self._date_tables
+        if tables is None or start_day < tables[0] or end_day > tables[0] + len(tables[1]) - 1:
+            start_day = min(start_day, tables[0]) if tables else start_day
+            days = np.arange(start_day, end_day + 1).astype('datetime64[D]')
+            months = days.astype('datetime64[M]')
+            years = (days.astype('datetime64[Y]').astype(np.int64) + 1970).tolist()
+            month_numbers = (months.astype(np.int64) % 12 + 1).tolist()
+            day_numbers = ((days - months).astype(np.int64) + 1).tolist()
+
+            thai = np.asarray([
+                f"{d} {constants.THAI_MONTHS[m]} {y + 543}"
+                for d, m, y in zip(day_numbers, month_numbers, years)
+            ], dtype=object)
+            english = np.asarray([
+                f"{d} {constants.ENGLISH_MONTHS[m]} {y}"
+                for d, m, y in zip(day_numbers, month_numbers, years)
+            ], dtype=object)
+            tables = self._date_tables = (start_day, thai, english)
+        return tables
+
+    @staticmethod
+    def _add_years(days: np.ndarray, years: int) -> np.ndarray:
+        dates = days.astype('datetime64[D]')
+        months = dates.astype('datetime64[M]')
+        day_of_month = (dates - months).astype(np.int64)
+        shifted = months + np.timedelta64(12 * years, 'M')
+        month_length = ((shifted + 1).astype('datetime64[D]') - shifted.astype('datetime64[D]')).astype(np.int64)
+        return (shifted.astype('datetime64[D]').astype(np.int64)
+                + np.minimum(day_of_month, month_length - 1))
+
+    def generate_batch(self,
+        n: int,
+        gender: str = 'random',
+        marital_status: str = 'random',
+        age_range: tuple = (18, 85),
+        issue_years_ago_range: tuple = (0, 10),
+        card_validity_years: int = 10,
+        rng: Optional[np.random.Generator] = None) -> IDCardBatch:
+
+        if rng is None:
+            rng = np.random.default_rng()
+
+        # gender / title: 0 = male, 1 = female_single, 2 = female_married
+        if gender == 'random':
+            is_male = rng.random(n) < 0.5
+        else:
+            is_male = np.full(n, gender == 'male')
+        if marital_status == 'random':
+            is_married = rng.random(n) < 0.5
+        else:
+            is_married = np.full(n, marital_status == 'married')
+        title_idx = np.where(is_male, 0, np.where(is_married, 2, 1))
+
+        titles = [constants.TITLE_PREFIXES[key] for key in ('male', 'female_single', 'female_married')]
+        titles_th = np.asarray([t['th'] for t in titles], dtype=object)[title_idx]
+        titles_en = np.asarray([t['en'] for t in titles], dtype=object)[title_idx]
+
+        male_names, female_names, family_names = self._get_name_arrays()
+        first_names = np.where(
+            is_male,
+            male_names[rng.integers(0, len(male_names), n)],
+            female_names[rng.integers(0, len(female_names), n)]
+        )
+        last_names = family_names[rng.integers(0, len(family_names), n)]
+        first_names_en = np.asarray([self._transliterate_name(name) for name in first_names], dtype=object)
+        last_names_en = np.asarray([self._transliterate_name(name) for name in last_names], dtype=object)
+
+        # dates as fractional days since the epoch, mirroring generate_dates
+        now = (self.current_date - datetime(1970, 1, 1)).total_seconds() / 86400
+        min_age, max_age = age_range
+        min_issue_ago, max_issue_ago = issue_years_ago_range
+        min_birth = now - max_age * 365.25
+        birth_span = int(np.floor((max_age - min_age) * 365.25))
+        birth = min_birth + rng.integers(0, birth_span + 1, n)
+
+        latest_issue = now - min_issue_ago * 365.25
+        earliest_issue = np.maximum(birth + 18 * 365.25, now - max_issue_ago * 365.25)
+        issue_span = np.floor(latest_issue - earliest_issue).astype(np.int64)
+        issue = np.where(
+            issue_span < 0,
+            latest_issue,
+            earliest_issue + rng.integers(0, np.maximum(issue_span, 0) + 1)
+        )
+
+        birth_day = np.floor(birth).astype(np.int64)
+        issue_day = np.floor(issue).astype(np.int64)
+        expiry_day = self._add_years(issue_day, card_validity_years)
+        age = np.floor(now - birth).astype(np.int64) // 365
+
+        start_day, thai_dates, english_dates = self._get_date_tables(
+            int(birth_day.min(initial=int(min_birth))), int(expiry_day.max(initial=int(now))))
+
+        religion = np.asarray(self.RELIGION_NAMES, dtype=object)[
+            rng.choice(len(self.RELIGION_NAMES), size=n, p=self.RELIGION_P)]
+
+        id_raw = self.generate_thai_ids(n, rng)
+        id_formatted = np.asarray(
+            [f"{i[0]} {i[1:5]} {i[5:10]} {i[10:12]} {i[12]}" for i in id_raw], dtype=object)
+
+        columns = {
+            'FullNameTH': np.asarray([f"{t} {f} {l}" for t, f, l in zip(titles_th, first_names, last_names)],
+                                     dtype=object),
+            'NameEN': np.asarray([f"{t} {f}" for t, f in zip(titles_en, first_names_en)], dtype=object),
+            'LastNameEN': last_names_en,
+            'BirthdayTH': thai_dates[birth_day - start_day],
+            'BirthdayEN': english_dates[birth_day - start_day],
+            'DateOfIssueTH': thai_dates[issue_day - start_day],
+            'DateOfIssueEN': english_dates[issue_day - start_day],
+            'DateOfExpiryTH': thai_dates[expiry_day - start_day],
+            'DateOfExpiryEN': english_dates[expiry_day - start_day],
+            'Identification_Number': id_formatted,
+            'Religion': religion,
+            '_first_name_th': first_names,
+            '_last_name_th': last_names,
+            '_first_name_en': first_names_en,
+            '_last_name_en': last_names_en,
+            '_gender': np.where(is_male, 'male', 'female').astype(object),
+            '_birth_date': birth_day.astype('datetime64[D]'),
+            '_issue_date': issue_day.astype('datetime64[D]'),
+            '_expiry_date': expiry_day.astype('datetime64[D]'),
+            '_age': age,
+            '_id_number_raw': id_raw,
+        }
+        columns.update(self._generate_address_batch(n, rng))
+        return IDCardBatch(columns)
+
+    def _generate_address_batch(self, n: int, rng: np.random.Generator) -> Dict[str, np.ndarray]:
+        if self.address_index is None:
+            return {'Address': np.full(n, self.generate_address()['Address'], dtype=object)}
+
+        formats = rng.integers(0, 3, n)
+        numbers = np.where(formats == 2, rng.integers(1, 100, n), rng.integers(1, 1000, n))
+        suffixes = np.where(formats == 1, rng.integers(1, 100, n), rng.integers(1, 10, n))
+        house_numbers = [
+            str(number) if fmt == 0 else f"{number}/{suffix}"
+            for fmt, number, suffix in zip(formats.tolist(), numbers.tolist(), suffixes.tolist())
+        ]
+
+        leaves = self.address_index.sample_batch(n, rng)
+        provinces, districts, sub_districts, fragments = self.address_index.parts_batch(leaves)
+        street_draws = rng.random(n).tolist()
+
+        addresses = []
+        for province, fragment, house_number, draw in zip(provinces, fragments, house_numbers, street_draws):
+            streets_list = self.street_fragments.get(province)
+            street = streets_list[int(draw * len(streets_list))] if streets_list else ""
+            addresses.append(f"{house_number}{street}{fragment}".strip())
+
+        return {
+            'Address': np.asarray(addresses, dtype=object),
+            '_province': provinces,
+            '_district': districts,
+            '_sub_district': sub_districts,
+            '_house_number': np.asarray(house_numbers, dtype=object),
+        }
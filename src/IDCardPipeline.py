@@ -0,0 +1,186 @@
+import json
+import random
+from .seeding import sample_rng, STAGE_GENERATE
+from .IDCardRenderer import IDCardRenderer
+from .IDCardDataGenerator import IDCardDataGenerator
+from .IDCardAugmentor import IDCardAugmentor, FIELD_MARGIN
+
+RENDER_CONFIG = 'configs/identity_card/config-for-feature-extraction.json'
+LABEL_CONFIG = 'configs/identity_card/config.json'
+TEMPLATE_PATH = 'template/personal-card-template.jpg'
+TH_FIELDS = ['FullNameTH', 'BirthdayTH', 'Religion', 'Address', 'DateOfIssueTH', 'DateOfExpiryTH']
+EN_FIELDS = ['Identification_Number', 'NameEN', 'LastNameEN', 'BirthdayEN', 'DateOfIssueEN', 'DateOfExpiryEN']
+
+
+class IDCardPipeline:
+    def __init__(self, generator, renderer, augmentor, field_definitions, selected_fields,
+                 age_range=(18, 85), seed=None, field_augmentations=None, field_margin=FIELD_MARGIN):
+        self.generator = generator
+        self.renderer = renderer
+        self.augmentor = augmentor
+        self.field_definitions = field_definitions
+        self.selected_fields = selected_fields
+        self.age_range = age_range
+        self.seed = seed if seed is not None else random.SystemRandom().randrange(2 ** 32)
+        # field name -> augmentations of that field's crop; None augments whole cards instead
+        self.field_augmentations = field_augmentations
+        self.field_margin = field_margin
+
+    @property
+    def num_augmentations(self):
+        if self.augmentor is None:
+            return 0
+        return max(0, self.augmentor.num_augmentations_per_image)
+
+    def build_boxes(self, sample_data):
+        boxes = []
+        for idx, field in enumerate(self.field_definitions):
+            field_name = field['name']
+            text = sample_data.get(field_name, "")
+
+            if field_name == 'Address':
+                text = f"ที่อยู่ {text}"
+
+            boxes.append({
+                'class_id': idx,
+                'class_name': field_name,
+                'bbox': field['point'],
+                'text': text
+            })
+        return boxes
+
+    def sample_data(self, index):
+        return self.generator.generate(
+            gender='random',
+            marital_status='random',
+            age_range=self.age_range,
+            rng=sample_rng(self.seed, STAGE_GENERATE, index)
+        )
+
+    def render_sample(self, index):
+        # the image is a view of the renderer canvas, valid until the next render
+        sample_data = self.sample_data(index)
+        self.renderer.render_data(sample_data)
+        return self.renderer.img_with_data, self.build_boxes(sample_data)
+
+    def augment_sample(self, index, k, image=None, boxes=None):
+        if image is None:
+            image, boxes = self.render_sample(index)
+        seeds = self.augmentor.augment_seeds(self.seed, index, [k])
+        results = self.augmentor.augment_boxes(image, boxes, seeds=seeds)
+        return results[0] if results else None
+
+    def iter_cards(self, index):
+        image, boxes = self.render_sample(index)
+        yield image, boxes
+        if self.num_augmentations:
+            yield from self.augmentor.augment_boxes(image, boxes, seeds=self.augmentor.augment_seeds(self.seed, index))
+
+    def iter_field_crops(self, index, image, boxes):
+        # the card's own crops first, then each field's augmentations in field order
+        yield from self.crop_fields(image, boxes, self.selected_fields)
+        boxes = [
+            box for box in boxes
+            if box['class_name'] in self.selected_fields and self.field_augmentations.get(box['class_name'], 0) > 0
+        ]
+        if not boxes:
+            return
+
+        fields = [
+            (box['bbox'], self.augmentor.field_seeds(self.seed, index, box['class_id'],
+                                                     self.field_augmentations[box['class_name']]))
+            for box in boxes
+        ]
+        for box, crops in zip(boxes, self.augmentor.augment_fields(image, fields, self.field_margin)):
+            for crop in crops:
+                yield crop, box.get('text', ''), box['class_name']
+
+    def iter_sample_crops(self, index):
+        if self.field_augmentations is not None:
+            image, boxes = self.render_sample(index)
+            yield from self.iter_field_crops(index, image, boxes)
+            return
+        for image, boxes in self.iter_cards(index):
+            yield from self.crop_fields(image, boxes, self.selected_fields)
+
+    @staticmethod
+    def clip_box(bbox, width, height):
+        x1, y1, x2, y2 = map(int, bbox)
+
+        x1 = max(0, x1)
+        y1 = max(0, y1)
+        x2 = min(width, x2)
+        y2 = min(height, y2)
+
+        if x2 <= x1 or y2 <= y1:
+            return None
+        return x1, y1, x2, y2
+
+    @staticmethod
+    def crop_fields(image, boxes, selected_fields):
+        for box in boxes:
+            class_name = box.get('class_name', '')
+
+            if class_name not in selected_fields:
+                continue
+
+            rect = IDCardPipeline.clip_box(box['bbox'], image.shape[1], image.shape[0])
+            if rect is None:
+                continue
+
+            x1, y1, x2, y2 = rect
+            yield image[y1:y2, x1:x2], box.get('text', ''), class_name
+
+
+def select_fields(lang):
+    if lang == 'th':
+        return TH_FIELDS
+    if lang == 'en':
+        return EN_FIELDS
+    return TH_FIELDS + EN_FIELDS
+
+
+def build_pipeline(num_augmentations, selected_fields, generator_options=None, seed=None,
+                   field_augmentations=None, field_margin=FIELD_MARGIN):
+    generator = IDCardDataGenerator(
+        male_names_path='datasets/thai-names-corpus/male_names_th.txt',
+        female_names_path='datasets/thai-names-corpus/female_names_th.txt',
+        family_names_path='datasets/thai-names-corpus/family_names_th.txt',
+        address_data_path='datasets/thai-province/province_with_district_and_sub_district.json',
+        streets_data_path='datasets/thai-province/thai_streets_all.json',
+        romanization_table_path='datasets/thai-names-corpus/romanized_names.tsv',
+        **(generator_options or {})
+    )
+
+    renderer = IDCardRenderer(
+        config_path=RENDER_CONFIG,
+        font_paths={
+            'thai': ['fonts/dilleniaupc/DilleniaUPC Bold.ttf'],
+            'english': ['fonts/dilleniaupc/DilleniaUPC Bold.ttf']
+        }
+    )
+
+    if not renderer.load_image(TEMPLATE_PATH):
+        print(f"Error: Cannot load template from {TEMPLATE_PATH}")
+        return None
+
+    augmentor = None
+    if num_augmentations > 0 or any((field_augmentations or {}).values()):
+        augmentor = IDCardAugmentor(
+            num_augmentations_per_image=num_augmentations
+        )
+
+    with open(LABEL_CONFIG, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    field_definitions = config['roi_extract']['front']
+
+    return IDCardPipeline(
+        generator=generator,
+        renderer=renderer,
+        augmentor=augmentor,
+        field_definitions=field_definitions,
+        selected_fields=selected_fields,
+        seed=seed,
+        field_augmentations=field_augmentations,
+        field_margin=field_margin
+    )
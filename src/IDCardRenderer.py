@@ -1,9 +1,180 @@
 import cv2
 import json
 import numpy as np
+from collections import OrderedDict
 from PIL import Image, ImageDraw, ImageFont
-import matplotlib.pyplot as plt
 from . import constants
+from .ImageCodec import ImageCodec
+from . import profiling
+
+MAX_CACHED_WORDS = 65536
+MAX_GLYPH_BYTES = 4 * 2 ** 20
+MAX_SPRITE_BYTES = 64 * 2 ** 20
+MAX_TOKEN_SIGHTINGS = 65536
+SPRITE_MIN_SIGHTINGS = 2
+SUBPIXEL_STEPS = 64
+
+
+def _quantize(offset):
+    # FreeType places glyphs in 1/64 pixel steps, and any non-zero offset renders unlike a zero one,
+    # so offsets in [0, 1) snap to the step that draws the same pixels
+    if offset == 0:
+        return 0.0
+    return min(SUBPIXEL_STEPS - 1, max(1, round(offset * SUBPIXEL_STEPS))) / SUBPIXEL_STEPS
+
+
+class _LRUCache:
+    __slots__ = ('max_size', 'size', 'entries')
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def pop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return None
+        self.size -= entry[1]
+        return entry[0]
+
+    def put(self, key, value, size):
+        self.pop(key)
+        self.entries[key] = (value, size)
+        self.size += size
+        while self.size > self.max_size:
+            _, (_, evicted) = self.entries.popitem(last=False)
+            self.size -= evicted
+
+
+class _FieldPlan:
+    __slots__ = ('name', 'x', 'y', 'box_width', 'box_height', 'font', 'color', 'multiline')
+
+    def __init__(self, name, x, y, box_width, box_height, font, color, multiline):
+        self.name = name
+        self.x = x
+        self.y = y
+        self.box_width = box_width
+        self.box_height = box_height
+        self.font = font
+        self.color = color
+        self.multiline = multiline
+
+
+class _FontMetrics:
+    __slots__ = ('font', 'space', 'line_height', 'slack', 'widths')
+
+    def __init__(self, font, line_height):
+        self.font = font
+        self.space = font.getlength(' ')
+        self.line_height = line_height
+        # summed advances stay within a few pixels of the ink width textbbox reports
+        self.slack = max(2, getattr(font, 'size', 16) / 4)
+        self.widths = {}
+
+    def word_width(self, word):
+        width = self.widths.get(word)
+        if width is None:
+            if len(self.widths) >= MAX_CACHED_WORDS:
+                self.widths.clear()
+            width = self.widths[word] = self.font.getlength(word)
+        return width
+
+
+class _SpriteCache:
+    # glyph masks and token sprites live in LRU caches bounded by bytes and shared by every font;
+    # a token is only kept once it recurs, so one-off names and numbers are composed and dropped
+    __slots__ = ('font', 'advances', 'kerning', 'glyphs', 'tokens', 'sightings')
+
+    def __init__(self, font, glyphs, tokens, sightings):
+        self.font = font
+        self.advances = {}
+        self.kerning = {}
+        self.glyphs = glyphs
+        self.tokens = tokens
+        self.sightings = sightings
+
+    def advance(self, char):
+        advance = self.advances.get(char)
+        if advance is None:
+            advance = self.advances[char] = self.font.getlength(char)
+        return advance
+
+    def kern(self, a, b):
+        pair = a + b
+        kerning = self.kerning.get(pair)
+        if kerning is None:
+            kerning = self.kerning[pair] = self.font.getlength(pair) - self.advance(a) - self.advance(b)
+        return kerning
+
+    def glyph(self, char, fx, fy):
+        fx, fy = _quantize(fx), _quantize(fy)
+        key = (self.font, char, fx, fy)
+        glyph = self.glyphs.get(key)
+        if glyph is None:
+            mask, (ox, oy) = self.font.getmask2(char, 'L', start=(fx, fy))
+            w, h = mask.size
+            glyph = (np.asarray(mask, dtype=np.uint8).reshape(h, w), ox, oy)
+            self.glyphs.put(key, glyph, w * h + 64)
+        return glyph
+
+    def token(self, text, fx, fy, color):
+        # a space-free token starting fx, fy past an integer pen position, composited from glyph
+        # masks the way FreeType's basic layout draws the whole string, as (inverse coverage,
+        # premultiplied ink, x, y, advance) with x, y relative to that integer position
+        fx, fy = _quantize(fx), _quantize(fy)
+        key = (self.font, text, fx, fy, color)
+        sprite = self.tokens.get(key)
+        if sprite is not None:
+            return sprite
+
+        profiling.count('sprite_misses')
+        placed = []
+        pen = fx
+        prev = None
+        for char in text:
+            if prev is not None:
+                pen += self.advance(prev) + self.kern(prev, char)
+            origin = int(pen)
+            mask, ox, oy = self.glyph(char, pen - origin, fy)
+            if mask.size:
+                placed.append((mask, origin + ox, oy))
+            prev = char
+        advance = pen - fx + self.advance(prev)
+
+        size = 64
+        if placed:
+            x1 = min(x for _, x, _ in placed)
+            y1 = min(y for _, _, y in placed)
+            x2 = max(x + mask.shape[1] for mask, x, _ in placed)
+            y2 = max(y + mask.shape[0] for mask, _, y in placed)
+            coverage = np.zeros((y2 - y1, x2 - x1, 1), dtype=np.uint16)
+            for mask, x, y in placed:
+                region = coverage[y - y1:y - y1 + mask.shape[0], x - x1:x - x1 + mask.shape[1], 0]
+                # later glyphs go over earlier ones with PIL's rounded divide by 255
+                t = region * (255 - mask) + 128
+                region[...] = mask + (((t >> 8) + t) >> 8)
+            ink = coverage * np.array(color[:3], dtype=np.uint16) + 128
+            sprite = (255 - coverage, ink, x1, y1, advance)
+            size += coverage.nbytes * 4
+        else:
+            sprite = (None, None, 0, 0, advance)
+
+        seen = (self.sightings.get(key) or 0) + 1
+        if seen < SPRITE_MIN_SIGHTINGS:
+            self.sightings.put(key, seen, 1)
+        else:
+            self.sightings.pop(key)
+            self.tokens.put(key, sprite, size)
+        return sprite
+
 
 class IDCardRenderer:
     def __init__(self, config_path, font_paths=None):
@@ -15,66 +186,201 @@ class IDCardRenderer:
         }
 
         self.img = None
+        self.img_path = None
         self.img_pil = None
         self.draw = None
+        self._canvas = None
+        self._template_bgrx = None
+
+        self._font_cache = {}
+        self._font_metrics = {}
+        self._sprite_caches = {}
+        self._glyphs = _LRUCache(MAX_GLYPH_BYTES)
+        self._sprites = _LRUCache(MAX_SPRITE_BYTES)
+        # sightings are sized one per token, so that cache is bounded by entries rather than bytes
+        self._sightings = _LRUCache(MAX_TOKEN_SIGHTINGS)
+        self.render_plan = self._compile_render_plan()
 
     def _load_config(self, config_path):
         with open(config_path, 'r', encoding='utf-8') as f:
             return json.load(f)
         
     def load_image(self, img_path):
+        if self.img is not None and img_path == self.img_path:
+            return True
+
         self.img = cv2.imread(img_path)
+        self.img_path = None
         if self.img is None:
             print(f"Error: Cannot load image from {img_path}")
             return False
+
+        # PIL only shares memory with 4-byte pixel buffers, so the canvas is
+        # BGRX: PIL draws into it in place and channel order stays BGR
+        h, w = self.img.shape[:2]
+        self.img_path = img_path
+        self._template_bgrx = cv2.cvtColor(self.img, cv2.COLOR_BGR2BGRA)
+        self._canvas = np.empty_like(self._template_bgrx)
+        self.img_pil = Image.frombuffer('RGBA', (w, h), self._canvas, 'raw', 'RGBA', 0, 1)
+        self.img_pil.readonly = 0
+        self.draw = ImageDraw.Draw(self.img_pil)
         return True
     
     def _load_font(self, font_list, size):
         for font_path in font_list:
+            key = (font_path, size)
+            font = self._font_cache.get(key)
+            if font is not None:
+                return font
             try:
-                return ImageFont.truetype(font_path, size)
+                font = ImageFont.truetype(font_path, size)
             except Exception as e:
                 continue
+            profiling.count('fonts_loaded')
+            self._font_cache[key] = font
+            return font
         print(f"Warning: Could not load any font, using default")
         return ImageFont.load_default()
+
+    def _compile_render_plan(self):
+        plan = []
+        for field in self.config['roi_extract']['front']:
+            field_name = field['name']
+            x1, y1, x2, y2 = field['point']
+            font_size = constants.FONT_SIZES.get(field_name, 24)
+
+            plan.append(_FieldPlan(
+                name=field_name,
+                x=x1 + 3,
+                y=y1,
+                box_width=x2 - x1,
+                box_height=y2 - y1,
+                font=self._get_font_for_field(field_name, font_size),
+                color=constants.FONT_COLORS.get(field_name, (0, 0, 0))[::-1],
+                multiline=field_name == "Address"
+            ))
+        return plan
     
+    def _get_font_metrics(self, font):
+        metrics = self._font_metrics.get(font)
+        if metrics is None:
+            bbox = self.draw.textbbox((0, 0), "A", font=font)
+            metrics = self._font_metrics[font] = _FontMetrics(font, bbox[3] - bbox[1])
+        return metrics
+
+    def _get_sprite_cache(self, font):
+        if font not in self._sprite_caches:
+            # sprites reproduce the basic layout only; raqm shapes whole runs and bitmap fonts have no masks
+            basic = isinstance(font, ImageFont.FreeTypeFont) and font.layout_engine == ImageFont.Layout.BASIC
+            self._sprite_caches[font] = (
+                _SpriteCache(font, self._glyphs, self._sprites, self._sightings) if basic else None
+            )
+        return self._sprite_caches[font]
+
+    def _draw_text(self, x, y, text, font, color):
+        sprites = self._get_sprite_cache(font)
+        if sprites is None:
+            self.draw.text((x, y), text, font=font, fill=color)
+            return
+
+        top = int(y)
+        fy = y - top
+        pen = x
+        last = None
+        right = None
+        placed = []
+        height, width = self._canvas.shape[:2]
+        for i, token in enumerate(text.split(' ')):
+            if i:
+                if last is not None:
+                    pen += sprites.kern(last, ' ')
+                pen += sprites.advance(' ')
+                last = ' '
+            if not token:
+                continue
+            if last is not None:
+                pen += sprites.kern(last, token[0])
+            origin = int(pen)
+            inverse, ink, ox, oy, advance = sprites.token(token, pen - origin, fy, color)
+            pen += advance
+            last = token[-1]
+            if inverse is None:
+                continue
+
+            gx, gy = origin + ox, top + oy
+            h, w = inverse.shape[:2]
+            # overlapping tokens have to be composited together and PIL clips at the edges,
+            # so those strings go through draw.text
+            if (right is not None and gx < right) or gx < 0 or gy < 0 or gx + w > width or gy + h > height:
+                profiling.count('sprite_fallbacks')
+                self.draw.text((x, y), text, font=font, fill=color)
+                return
+            right = gx + w
+            placed.append((inverse, ink, gx, gy))
+
+        # the same rounded blend PIL uses to draw a coverage mask in a solid colour
+        for inverse, ink, gx, gy in placed:
+            h, w = inverse.shape[:2]
+            region = self._canvas[gy:gy + h, gx:gx + w, :3]
+            t = region * inverse
+            t += ink
+            t += t >> 8
+            region[...] = t >> 8
+
     def _wrap_text(self, text, font, max_width):
+        metrics = self._get_font_metrics(font)
         lines = []
-        words = text.split(' ')
         current_line = []
+        current_width = 0
         
-        for word in words:
-            test_line = ' '.join(current_line + [word])
-            bbox = self.draw.textbbox((0, 0), test_line, font=font)
-            test_width = bbox[2] - bbox[0]
+        for word in text.split(' '):
+            word_width = metrics.word_width(word)
+            test_width = current_width + metrics.space + word_width if current_line else word_width
+
+            # only lines near the limit need the exact shaped width of the joined text
+            if test_width + metrics.slack <= max_width:
+                fits = True
+            elif test_width - metrics.slack > max_width:
+                fits = False
+            else:
+                bbox = self.draw.textbbox((0, 0), ' '.join(current_line + [word]), font=font)
+                fits = bbox[2] - bbox[0] <= max_width
             
-            if test_width <= max_width:
+            if fits:
                 current_line.append(word)
+                current_width = test_width
             else:
                 if current_line:
                     lines.append(' '.join(current_line))
                 current_line = [word]
+                current_width = word_width
         
         if current_line:
             lines.append(' '.join(current_line))
         
         return lines
 
-    def _draw_multiline_text(self, position, text, font, color, box_width, 
-                            box_height, line_spacing=1.2, first_line_indent=0):
+    def _layout_multiline_text(self, position, text, font, box_width, line_spacing=1.2, first_line_indent=0):
         x, y = position
         lines = self._wrap_text(text, font, box_width - 6)
-        
-        bbox = self.draw.textbbox((0, 0), "A", font=font)
-        line_height = (bbox[3] - bbox[1]) * line_spacing
+        line_height = self._get_font_metrics(font).line_height * line_spacing
         
         current_y = y
+        placed = []
         
         for idx, line in enumerate(lines):
             indent = first_line_indent if idx == 0 else 0
-            self.draw.text((x + indent, current_y), line, font=font, fill=color)
+            placed.append((x + indent, current_y, line))
             current_y += line_height
         
+        return placed
+
+    def _draw_multiline_text(self, position, text, font, color, box_width, 
+                            box_height, line_spacing=1.2, first_line_indent=0):
+        lines = self._layout_multiline_text(position, text, font, box_width, line_spacing, first_line_indent)
+        for x, y, line in lines:
+            self._draw_text(x, y, line, font, color)
+        
         return len(lines)
     
     def _get_font_for_field(self, field_name, font_size):
@@ -86,50 +392,48 @@ class IDCardRenderer:
         else:
             return self._load_font(self.font_paths['english'], font_size)
         
+    def _layout(self, data):
+        ops = []
+        for field in self.render_plan:
+            text = data.get(field.name, "TEST")
+
+            if field.multiline:
+                lines = self._layout_multiline_text(
+                    (field.x, field.y),
+                    text,
+                    field.font,
+                    field.box_width,
+                    line_spacing=2.2,
+                    first_line_indent=33
+                )
+                ops.extend((field.name, x, y, line, field.font, field.color) for x, y, line in lines)
+            else:
+                ops.append((field.name, field.x, field.y, text, field.font, field.color))
+        return ops
+
     def render_data(self, data):
         if self.img is None:
             print("Error: No image loaded. Call load_image() first")
             return
         
-        img_with_data = self.img.copy()
-        self.img_pil = Image.fromarray(cv2.cvtColor(img_with_data, cv2.COLOR_BGR2RGB))
-        self.draw = ImageDraw.Draw(self.img_pil)
-        
-        front_fields = self.config['roi_extract']['front']
-        
-        for field in front_fields:
-            field_name = field['name']
-            x1, y1, x2, y2 = field['point']
-            
-            text = data.get(field_name, "TEST")
-            box_width = x2 - x1
-            box_height = y2 - y1
-            
-            font_size = constants.FONT_SIZES.get(field_name, 24)
-            font = self._get_font_for_field(field_name, font_size)
-            text_color = constants.FONT_COLORS.get(field_name, (0, 0, 0))
-            
-            if field_name == "Address":
-                self._draw_multiline_text(
-                    (x1 + 3, y1), 
-                    text, 
-                    font, 
-                    text_color, 
-                    box_width, 
-                    box_height,
-                    line_spacing=2.2,
-                    first_line_indent=33
-                )
-            else:
-                self.draw.text((x1 + 3, y1), text, font=font, fill=text_color)
+        np.copyto(self._canvas, self._template_bgrx)
+
+        with profiling.timer('render.layout'):
+            ops = self._layout(data)
+        for name, x, y, text, font, color in ops:
+            with profiling.timer('render.' + name):
+                self._draw_text(x, y, text, font, color)
         
-        self.img_with_data = cv2.cvtColor(np.array(self.img_pil), cv2.COLOR_RGB2BGR)
+        # BGR view of the shared canvas; overwritten by the next render_data call
+        self.img_with_data = self._canvas[..., :3]
 
     def show(self, title='ID Card with Sample Data'):
         if not hasattr(self, 'img_with_data'):
             print("Error: No rendered data. Call render_data() first")
             return
-        
+
+        import matplotlib.pyplot as plt
+
         plt.figure(figsize=(15, 8))
         plt.imshow(cv2.cvtColor(self.img_with_data, cv2.COLOR_BGR2RGB))
         plt.axis('off')
@@ -137,10 +441,16 @@ class IDCardRenderer:
         plt.tight_layout()
         plt.show()
 
-    def save(self, output_path):
+    def save(self, output_path, writer=None, codec=None):
         if not hasattr(self, 'img_with_data'):
             print("Error: No rendered data. Call render_data() first")
             return False
         
-        cv2.imwrite(output_path, self.img_with_data)
+        codec = codec or ImageCodec.for_path(output_path)
+        if writer is not None:
+            # the canvas is reused by the next render, so the writer gets its own copy
+            writer.write_image(output_path, self.img_with_data.copy(), codec)
+            return True
+
+        codec.write(output_path, self.img_with_data)
         return True
\ No newline at end of file
@@ -0,0 +1,143 @@
+import queue
+import random
+import itertools
+import threading
+from .IDCardPipeline import build_pipeline, select_fields, TH_FIELDS, EN_FIELDS
+from .IDCardAugmentor import FIELD_MARGIN
+from .seeding import derive_seed, STAGE_EPOCH
+
+try:
+    from torch.utils.data import IterableDataset, get_worker_info
+except ImportError:
+    # without torch the stream is a plain iterable and data-loader workers are not detected
+    IterableDataset = object
+    get_worker_info = None
+
+_END = object()
+
+
+class _Failure:
+    __slots__ = ('error',)
+
+    def __init__(self, error):
+        self.error = error
+
+
+class IDCardStream(IterableDataset):
+    def __init__(self, lang='all', fields=None, num_augmentations=3, aug_mode='card', field_augmentations=None,
+                 field_margin=FIELD_MARGIN, seed=None, generator_options=None, num_cards=None,
+                 rank=0, world_size=1, prefetch=256):
+        if aug_mode not in ('card', 'field'):
+            raise ValueError(f"Unknown aug_mode: {aug_mode}")
+        if field_augmentations and aug_mode != 'field':
+            raise ValueError("field_augmentations requires aug_mode='field'")
+
+        self.fields = list(fields) if fields is not None else select_fields(lang)
+        known = TH_FIELDS + EN_FIELDS
+        unknown = [field for field in self.fields + list(field_augmentations or {}) if field not in known]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+
+        self.num_augmentations = num_augmentations
+        self.field_augmentations = None
+        if aug_mode == 'field':
+            overrides = field_augmentations or {}
+            self.field_augmentations = {field: overrides.get(field, num_augmentations) for field in self.fields}
+        self.field_margin = field_margin
+        self.seed = seed if seed is not None else random.SystemRandom().randrange(2 ** 32)
+        self.generator_options = generator_options
+        self.num_cards = num_cards
+        self.rank = rank
+        self.world_size = world_size
+        self.prefetch = prefetch
+        self.epoch = 0
+        self._pipeline = None
+
+    def __getstate__(self):
+        # data-loader workers get the settings and build their own pipeline
+        state = self.__dict__.copy()
+        state['_pipeline'] = None
+        return state
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def epoch_seed(self):
+        # epoch 0 draws the same cards as generate_dataset.py --seed; later epochs get fresh ones
+        if self.epoch == 0:
+            return self.seed
+        return derive_seed(self.seed, STAGE_EPOCH, self.epoch)
+
+    def _get_pipeline(self):
+        if self._pipeline is None:
+            self._pipeline = build_pipeline(self.num_augmentations, self.fields, self.generator_options, self.seed,
+                                            self.field_augmentations, self.field_margin)
+            if self._pipeline is None:
+                raise RuntimeError("Cannot build the card pipeline")
+        return self._pipeline
+
+    def _partition(self):
+        worker_id, num_workers = 0, 1
+        info = get_worker_info() if get_worker_info is not None else None
+        if info is not None:
+            worker_id, num_workers = info.id, info.num_workers
+        return self.rank * num_workers + worker_id, self.world_size * num_workers
+
+    def __iter__(self):
+        # partitions take every n-th card, so no two workers or ranks produce the same card
+        partition, partitions = self._partition()
+        if self.num_cards is None:
+            cards = itertools.count(partition, partitions)
+        else:
+            cards = range(partition, self.num_cards, partitions)
+
+        samples = self._samples(cards)
+        if self.prefetch <= 0:
+            return samples
+        return self._prefetched(samples)
+
+    def _samples(self, cards):
+        pipeline = self._get_pipeline()
+        pipeline.seed = self.epoch_seed()
+        for i in cards:
+            for crop, text, field_name in pipeline.iter_sample_crops(i):
+                # crops are views of the renderer canvas and augmented cards, which later cards reuse
+                yield crop.copy(), text, field_name
+
+    def _prefetched(self, samples):
+        buffer = queue.Queue(self.prefetch)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    buffer.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce():
+            try:
+                for sample in samples:
+                    if not put(sample):
+                        return
+                put(_END)
+            except BaseException as e:
+                put(_Failure(e))
+            finally:
+                samples.close()
+
+        thread = threading.Thread(target=produce, name='IDCardStream-prefetch', daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = buffer.get()
+                if item is _END:
+                    return
+                if isinstance(item, _Failure):
+                    raise item.error
+                yield item
+        finally:
+            stop.set()
+            thread.join()
@@ -0,0 +1,141 @@
+import io
+import os
+import time
+import numpy as np
+from . import profiling
+
+EXTENSIONS = {'jpeg': '.jpg', 'png': '.png', 'webp': '.webp', 'raw': '.npy'}
+OPTIONS = {
+    'jpeg': {'quality', 'optimize', 'progressive'},
+    'png': {'compression'},
+    'webp': {'quality', 'lossless'},
+    'raw': set()
+}
+FLAGS = {'optimize', 'progressive', 'lossless'}
+
+
+class ImageCodec:
+    def __init__(self, name='jpeg', quality=None, optimize=False, progressive=False, compression=None,
+                 lossless=False, label=None):
+        if name not in EXTENSIONS:
+            raise ValueError(f"Unknown codec {name}; expected one of: {', '.join(EXTENSIONS)}")
+        if quality is not None and not 0 <= quality <= 100:
+            raise ValueError(f"{name} quality must be 0-100, got {quality}")
+        if compression is not None and not 0 <= compression <= 9:
+            raise ValueError(f"png compression must be 0-9, got {compression}")
+
+        self.name = name
+        self.quality = quality
+        self.optimize = optimize
+        self.progressive = progressive
+        self.compression = compression
+        self.lossless = lossless
+        self.ext = EXTENSIONS[name]
+        self.label = label or self.spec
+        self.params = self._params()
+
+    @classmethod
+    def parse(cls, spec, label=None):
+        # NAME[:OPTION[=VALUE],...], e.g. jpeg:quality=90,progressive or png:compression=1
+        name, _, options = spec.partition(':')
+        kwargs = {}
+        for option in filter(None, options.split(',')):
+            key, _, value = option.partition('=')
+            if key not in OPTIONS.get(name, ()):
+                raise ValueError(f"Unknown {name} option: {key}")
+            if key in FLAGS:
+                kwargs[key] = True
+            elif not value.isdigit():
+                raise ValueError(f"{name} option {key} expects an integer, got {value or 'nothing'}")
+            else:
+                kwargs[key] = int(value)
+        return cls(name, label=label, **kwargs)
+
+    @classmethod
+    def for_path(cls, path):
+        ext = os.path.splitext(path)[1].lower()
+        for name, codec_ext in EXTENSIONS.items():
+            if ext == codec_ext or (name == 'jpeg' and ext == '.jpeg'):
+                return cls(name)
+        raise ValueError(f"No codec for {path}")
+
+    @property
+    def spec(self):
+        options = []
+        if self.quality is not None:
+            options.append(f'quality={self.quality}')
+        if self.compression is not None:
+            options.append(f'compression={self.compression}')
+        options += [flag for flag in ('optimize', 'progressive', 'lossless') if getattr(self, flag)]
+        return f"{self.name}:{','.join(options)}" if options else self.name
+
+    def __repr__(self):
+        return f'ImageCodec({self.spec!r})'
+
+    def _params(self):
+        import cv2
+
+        # unset options are left to OpenCV's defaults, so plain jpeg matches cv2.imwrite
+        params = []
+        if self.name == 'jpeg':
+            if self.quality is not None:
+                params += [cv2.IMWRITE_JPEG_QUALITY, self.quality]
+            if self.optimize:
+                params += [cv2.IMWRITE_JPEG_OPTIMIZE, 1]
+            if self.progressive:
+                params += [cv2.IMWRITE_JPEG_PROGRESSIVE, 1]
+        elif self.name == 'png':
+            if self.compression is not None:
+                params += [cv2.IMWRITE_PNG_COMPRESSION, self.compression]
+        elif self.name == 'webp':
+            # OpenCV switches WebP to lossless above quality 100
+            if self.lossless:
+                params += [cv2.IMWRITE_WEBP_QUALITY, 101]
+            elif self.quality is not None:
+                params += [cv2.IMWRITE_WEBP_QUALITY, self.quality]
+        return params
+
+    def encode(self, image):
+        import cv2
+
+        start = time.perf_counter_ns()
+        if self.name == 'raw':
+            buffer = io.BytesIO()
+            np.save(buffer, np.ascontiguousarray(image), allow_pickle=False)
+            data = buffer.getvalue()
+        else:
+            ok, encoded = cv2.imencode(self.ext, image, self.params)
+            if not ok:
+                raise IOError(f"Could not encode image as {self.spec}")
+            data = encoded.tobytes()
+
+        if profiling.enabled():
+            profiling.add_time(f'io.encode.{self.label}', time.perf_counter_ns() - start)
+            profiling.count(f'io.encode.{self.label}.bytes', len(data))
+            profiling.count(f'io.encode.{self.label}.raw_bytes', image.nbytes)
+        return data
+
+    def write(self, path, image):
+        data = self.encode(image)
+        with profiling.timer('io.write'), open(path, 'wb') as f:
+            f.write(data)
+
+
+def decode_image(data, ext):
+    import cv2
+
+    if ext == EXTENSIONS['raw']:
+        return np.load(io.BytesIO(data), allow_pickle=False)
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+def read_image(path):
+    import cv2
+
+    # like cv2.imread, a missing or unreadable file gives None
+    if os.path.splitext(path)[1] == EXTENSIONS['raw']:
+        try:
+            return np.load(path, allow_pickle=False)
+        except (OSError, ValueError):
+            return None
+    return cv2.imread(path)
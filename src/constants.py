@@ -53,4 +53,12 @@ ENGLISH_MONTHS = {
     1: 'Jan.', 2: 'Feb.', 3: 'Mar.', 4: 'Apr.',
     5: 'May', 6: 'Jun.', 7: 'Jul.', 8: 'Aug.',
     9: 'Sep.', 10: 'Oct.', 11: 'Nov.', 12: 'Dec.'
-}
\ No newline at end of file
+}
+
+RELIGIONS = [
+    ('พุทธ', 94.0),
+    ('อิสลาม', 5.0),
+    ('คริสต์', 0.7),
+    ('ฮินดู', 0.2),
+    ('ซิกข์', 0.1)
+]
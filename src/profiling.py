@@ -0,0 +1,165 @@
+import os
+import glob
+import time
+import threading
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+_enabled = False
+_dump_prefix = None
+_lock = threading.Lock()
+_times = Counter()
+_calls = Counter()
+_counters = Counter()
+_null_timer = nullcontext()
+_cprofile = None
+_cprofile_path = None
+
+
+def enable(dump_prefix=None):
+    global _enabled, _dump_prefix
+    _enabled = True
+    _dump_prefix = dump_prefix
+
+
+def enabled():
+    return _enabled
+
+
+class _Timer:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+
+    def __exit__(self, *exc):
+        add_time(self.name, time.perf_counter_ns() - self.start)
+
+
+def timer(name):
+    # disabled timers are one shared no-op context, so instrumented code costs a call when off
+    return _Timer(name) if _enabled else _null_timer
+
+
+def add_time(name, ns):
+    with _lock:
+        _times[name] += ns
+        _calls[name] += 1
+
+
+def count(name, n=1):
+    if _enabled:
+        with _lock:
+            _counters[name] += n
+
+
+def take():
+    with _lock:
+        stats = {'times': dict(_times), 'calls': dict(_calls), 'counters': dict(_counters)}
+        _times.clear()
+        _calls.clear()
+        _counters.clear()
+    return stats
+
+
+def merge(stats):
+    with _lock:
+        _times.update(stats['times'])
+        _calls.update(stats['calls'])
+        _counters.update(stats['counters'])
+
+
+def stage_dump_path(name):
+    if _dump_prefix is None:
+        return None
+    return f'{_dump_prefix}.{name}.pstats'
+
+
+def profile_call(path, fn, *args):
+    import cProfile
+
+    global _cprofile, _cprofile_path
+    if path != _cprofile_path:
+        _cprofile = cProfile.Profile()
+        _cprofile_path = path
+
+    _cprofile.enable()
+    try:
+        return fn(*args)
+    finally:
+        _cprofile.disable()
+        _cprofile.dump_stats(path)
+
+
+@contextmanager
+def stage(name):
+    if not _enabled:
+        yield
+        return
+
+    path = stage_dump_path(name)
+    profile = None
+    if path is not None:
+        import cProfile
+        profile = cProfile.Profile()
+        profile.enable()
+
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        add_time(f'stage.{name}', time.perf_counter_ns() - start)
+        if profile is not None:
+            profile.disable()
+            _write_stage_profile(profile, path)
+
+
+def _write_stage_profile(profile, path):
+    import pstats
+
+    # worker processes dump their share of the stage next to it as <path>.<pid>
+    stats = pstats.Stats(profile)
+    for worker_path in glob.glob(f'{glob.escape(path)}.*'):
+        stats.add(worker_path)
+        os.remove(worker_path)
+    stats.dump_stats(path)
+    print(f"  cProfile stats for {path[len(_dump_prefix) + 1:-len('.pstats')]} written to {path}")
+
+
+def print_report():
+    stats = take()
+    times = stats['times']
+    calls = stats['calls']
+
+    print("=" * 60)
+    print("Profile")
+    print(f"  {'step':<36} {'total s':>9} {'calls':>9} {'mean ms':>9}")
+    stages = sorted((name for name in times if name.startswith('stage.')), key=times.get, reverse=True)
+    steps = sorted((name for name in times if not name.startswith('stage.')), key=times.get, reverse=True)
+    for name in stages + steps:
+        total = times[name] / 1e9
+        print(f"  {name:<36} {total:9.3f} {calls[name]:9d} {total * 1000 / calls[name]:9.3f}")
+    print("  stage.* rows are wall time in the main process; other rows are summed over workers and writer threads")
+
+    # ImageCodec.encode records time under io.encode.<label> and sizes under io.encode.<label>.bytes/.raw_bytes
+    counters = stats['counters']
+    codecs = sorted(name for name in times if name.startswith('io.encode.') and f'{name}.bytes' in counters)
+    if codecs:
+        print("Encoding")
+        print(f"  {'codec':<36} {'images':>9} {'MiB':>9} {'KiB/image':>10} {'ratio':>7} {'ms/image':>9}")
+        for name in codecs:
+            size = counters[f'{name}.bytes']
+            print(f"  {name[len('io.encode.'):]:<36} {calls[name]:9d} {size / 2 ** 20:9.1f} "
+                  f"{size / 1024 / calls[name]:10.1f} {counters.get(f'{name}.raw_bytes', 0) / max(size, 1):7.1f} "
+                  f"{times[name] / 1e6 / calls[name]:9.3f}")
+        print("  ratio is uncompressed pixel bytes per encoded byte")
+
+    counters = {name: value for name, value in counters.items() if not name.startswith('io.encode.')}
+    if counters:
+        print("Counters")
+        for name, value in sorted(counters.items()):
+            print(f"  {name:<36} {value:9d}")
+    print("=" * 60)
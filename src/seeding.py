@@ -0,0 +1,16 @@
+import random
+import numpy as np
+
+STAGE_GENERATE = 0
+STAGE_AUGMENT = 1
+STAGE_PHOTOMETRIC = 2
+STAGE_FIELD_AUGMENT = 3
+STAGE_EPOCH = 4
+
+
+def derive_seed(seed, *keys):
+    return int(np.random.SeedSequence([seed, *keys]).generate_state(1, dtype=np.uint64)[0])
+
+
+def sample_rng(seed, *keys):
+    return random.Random(derive_seed(seed, *keys))